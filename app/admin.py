@@ -1,16 +1,21 @@
 from aiogram import Router, F, Bot
 from aiogram.filters import StateFilter, CommandStart, Command
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, FSInputFile, BufferedInputFile
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 from datetime import datetime
 
 from app.custom_filters import AdminProtect, ADMINS
 
 import app.database.requests as rq
+from app.database.models import test_content_hash
 import app.keyboards as kb
+from app.broadcast import notify_users, notify_chats
+from app.jobs import job_handler, job_queue, job_title, PROGRESS_ROWS, STATUS_TITLES
+from app.validation import validate_questions, format_errors
+from app.files import IMPORT_EXTENSIONS, open_table, map_chunks, ReportWorkbook, write_excel, remove_file, save_upload, upload_source, discard_upload
 
 import pandas as pd
-import os
 
 
 admin = Router()
@@ -66,8 +71,7 @@ async def remove_admin(message: Message, state: FSMContext, bot: Bot):
     else:
         await rq.delete_admin(tg_id)
         await message.answer(f"✅ Пользователь с TG ID \"{tg_id}\" успешно удалён из администраторов.")
-        for admin in admins:
-            await bot.send_message(chat_id=admin.tg_id, text=f"⚠️ Администратор с TG ID \"{tg_id}\" был удалён из списка администраторов.")
+        await notify_chats([admin.tg_id for admin in admins], f"⚠️ Администратор с TG ID \"{tg_id}\" был удалён из списка администраторов.")
         ADMINS.remove(tg_id)  # Обновляем список админов в памяти
     await state.clear()
 
@@ -88,12 +92,7 @@ async def save_subject(message: Message, state: FSMContext, bot: Bot):
     await rq.add_subject(name=subject_name)
     await message.answer(f"✅ Предмет '{subject_name}' успешно добавлен!")
     await state.clear()
-    users = await rq.get_users()
-    for user in users:
-        try:
-            await bot.send_message(chat_id=user.tg_id, text=f'╔════════════════════════════════╗\n║  🚀 <b>ГОРЯЧИЕ НОВОСТИ!</b> 🚀  ║\n╚════════════════════════════════╝\n\n✨ <i>Специально для вас!</i> ✨\n\n📚 <b>Новый предмет:</b>\n   <code>{subject_name}</code>\n\n🎯 Спешите добавить в закладки!\n💡 Не пропустите интересный контент!\n\n⚡ <b>Начните изучение прямо сейчас!</b>\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━', parse_mode='HTML')
-        except Exception as e:
-            print(f"Ошибка отправки сообщения пользователю {user.tg_id}: {e}")
+    await notify_users(report_chat_id=message.from_user.id, kind='subject', name=subject_name, text=f'╔════════════════════════════════╗\n║  🚀 <b>ГОРЯЧИЕ НОВОСТИ!</b> 🚀  ║\n╚════════════════════════════════╝\n\n✨ <i>Специально для вас!</i> ✨\n\n📚 <b>Новый предмет:</b>\n   <code>{subject_name}</code>\n\n🎯 Спешите добавить в закладки!\n💡 Не пропустите интересный контент!\n\n⚡ <b>Начните изучение прямо сейчас!</b>\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━')
             
             
 @admin.callback_query(F.data == 'empty_data', AdminProtect())
@@ -127,8 +126,7 @@ async def remove_subject(message: Message, state: FSMContext, bot: Bot):
     if subject_to_delete:
         await rq.delete_subject(subject_to_delete.id)
         await message.answer(f"✅ Предмет '{subject_name}' успешно удалён!")
-        for admin in admins:
-            await bot.send_message(chat_id=admin.tg_id, text=f"⚠️ Предмет \"{subject_name}\" был удалён из базы данных.")
+        await notify_chats([admin.tg_id for admin in admins], f"⚠️ Предмет \"{subject_name}\" был удалён из базы данных.")
     else:
         await message.answer(f"⚠️ Предмет '{subject_name}' не найден.")
     await state.clear()
@@ -175,12 +173,7 @@ async def save_theme_description(message: Message, state: FSMContext, bot: Bot):
     await message.answer(f"✅ Тема '{theme_name}' успешно добавлена!")
     await state.clear()
     
-    users = await rq.get_users()
-    for user in users:
-        try:
-            await bot.send_message(chat_id=user.tg_id, text=f'╔════════════════════════════════╗\n║  ⭐ <b>НОВАЯ ТЕМА!</b> ⭐  ║\n╚════════════════════════════════╝\n\n🎓 <i>Добавлен свежий материал!</i> 🎓\n\n📖 <b>Новая тема:</b>\n   <code>{theme_name}</code>\n\n📝 <b>Описание:</b>\n<i>{theme_description}</i>\n\n🚀 Начните обучение сейчас!\n💪 Расширяйте свои знания!\n\n⚡ <b>Уровень мастерства ждёт вас!</b>\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━', parse_mode='HTML')
-        except Exception as e:
-            print(f"Ошибка отправки сообщения пользователю {user.tg_id}: {e}")
+    await notify_users(report_chat_id=message.from_user.id, kind='theme', name=theme_name, segment={'subject_id': theme_id}, text=f'╔════════════════════════════════╗\n║  ⭐ <b>НОВАЯ ТЕМА!</b> ⭐  ║\n╚════════════════════════════════╝\n\n🎓 <i>Добавлен свежий материал!</i> 🎓\n\n📖 <b>Новая тема:</b>\n   <code>{theme_name}</code>\n\n📝 <b>Описание:</b>\n<i>{theme_description}</i>\n\n🚀 Начните обучение сейчас!\n💪 Расширяйте свои знания!\n\n⚡ <b>Уровень мастерства ждёт вас!</b>\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━')
             
             
 @admin.message(F.text == '🗑️ Удалить тему', AdminProtect())
@@ -206,8 +199,7 @@ async def remove_theme(message: Message, state: FSMContext, bot: Bot):
     if theme_to_delete:
         await rq.delete_theme(theme_to_delete.id)
         await message.answer(f"✅ Тема '{theme_name}' успешно удалена!")
-        for admin in admins:
-            await bot.send_message(chat_id=admin.tg_id, text=f"⚠️ Тема \"{theme_name}\" была удалёна из базы данных.")
+        await notify_chats([admin.tg_id for admin in admins], f"⚠️ Тема \"{theme_name}\" была удалёна из базы данных.")
     else:
         await message.answer(f"⚠️ Тема '{theme_name}' не найдена.")
     await state.clear()
@@ -348,12 +340,7 @@ async def save_correct_answer(message: Message, state: FSMContext, bot: Bot):
     subject = await rq.get_subject(subject_id=subject_id)
     theme = await rq.get_theme(theme_id)
     
-    users = await rq.get_users()
-    for user in users:
-        try:
-            await bot.send_message(chat_id=user.tg_id, text=f'╔════════════════════════════════╗\n║  🧠 <b>НОВЫЙ ВОПРОС!</b> 🧠  ║\n╚════════════════════════════════╝\n\n📚 <b>Предмет:</b>\n<code>{subject.name}</code>\n\n📖 <b>Тема:</b>\n<code>{theme.name}</code>\n\n💡 Новый вопрос готов для тестирования!\n\n🚀 <b>Проверьте свои знания!</b>\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━', parse_mode='HTML')
-        except Exception as e:
-            print(f"Ошибка отправки сообщения пользователю {user.tg_id}: {e}")
+    await notify_users(report_chat_id=message.from_user.id, kind='question', segment={'subject_id': subject_id}, text=f'╔════════════════════════════════╗\n║  🧠 <b>НОВЫЙ ВОПРОС!</b> 🧠  ║\n╚════════════════════════════════╝\n\n📚 <b>Предмет:</b>\n<code>{subject.name}</code>\n\n📖 <b>Тема:</b>\n<code>{theme.name}</code>\n\n💡 Новый вопрос готов для тестирования!\n\n🚀 <b>Проверьте свои знания!</b>\n\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━')
             
             
 @admin.message(F.text == '🗑️ Удалить вопрос', AdminProtect())
@@ -379,8 +366,7 @@ async def remove_question(message: Message, state: FSMContext, bot: Bot):
     if test_to_delete:
         await rq.delete_test(test_to_delete.id)
         await message.answer(f"✅ Вопрос '{question_name}' успешно удалён!")
-        for admin in admins:
-            await bot.send_message(chat_id=admin.tg_id, text=f"⚠️ Вопрос \"{question_name}\" был удалён из базы данных.")
+        await notify_chats([admin.tg_id for admin in admins], f"⚠️ Вопрос \"{question_name}\" был удалён из базы данных.")
     else:
         await message.answer(f"⚠️ Вопрос '{question_name}' не найден.")
     await state.clear()
@@ -396,7 +382,7 @@ async def start_questions_import(message: Message, state: FSMContext):
     try:
         await message.answer(
             "📁 <b>МАССОВЫЙ ИМПОРТ ВОПРОСОВ</b>\n\n"
-            "Отправьте Excel файл (.xlsx) с вопросами.\n\n"
+            "Отправьте файл с вопросами: Excel (.xlsx), CSV, JSON Lines или Parquet.\n\n"
             "<b>Формат файла (9 колонок):</b>\n"
             "• A: ID предмета (число)\n"
             "• B: Название предмета\n"
@@ -410,7 +396,8 @@ async def start_questions_import(message: Message, state: FSMContext):
             "⚠️ <b>Важно:</b>\n"
             "• Без заголовков - сразу данные\n"
             "• Предмет и тема должны существовать в БД\n"
-            "• Варианты через символ | (вертикальная черта)",
+            "• Варианты через символ | (вертикальная черта)\n"
+            "• CSV - через запятую; JSON Lines - по массиву из 9 значений в строке",
             parse_mode='HTML'
         )
         
@@ -420,179 +407,237 @@ async def start_questions_import(message: Message, state: FSMContext):
             FSInputFile(example_file),
             caption="📄 Пример файла для импорта вопросов"
         )
-        os.remove(example_file)
+        await remove_file(example_file)
         
         await state.set_state('importing_questions_file')
+        await state.set_data({})
         
     except Exception as e:
         print(f"Ошибка в start_questions_import: {e}")
         await message.answer(f"❌ Произошла ошибка: {str(e)}")
 
 
+@admin.message(F.text == '🔄 Обновить вопросы', AdminProtect())
+async def start_questions_update(message: Message, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    """Повторный импорт исправленного файла: меняются только отличающиеся вопросы"""
+    await message.answer(
+        "🔄 <b>ОБНОВЛЕНИЕ ВОПРОСОВ ИЗ ФАЙЛА</b>\n\n"
+        "Отправьте исправленный файл в том же формате, что и для импорта (9 колонок).\n\n"
+        "• Вопрос ищется по теме и названию\n"
+        "• Новые вопросы добавляются, изменённые - обновляются\n"
+        "• Вопросы без изменений не трогаются",
+        parse_mode='HTML'
+    )
+    await state.set_state('importing_questions_file')
+    await state.set_data({'mode': 'upsert'})
+
+
+@admin.message(F.text == '🔍 Проверить вопросы', AdminProtect())
+async def start_questions_check(message: Message, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    """Проверка файла без импорта: ошибки по всем строкам приходят одним файлом"""
+    await message.answer(
+        "🔍 <b>ПРОВЕРКА ФАЙЛА С ВОПРОСАМИ</b>\n\n"
+        "Отправьте файл в формате импорта (9 колонок).\n\n"
+        "• В базу ничего не запишется\n"
+        "• В ответ придёт Excel со всеми ошибками и номерами строк\n"
+        "• Исправьте их и загрузите файл через «📁 Импорт вопросов»",
+        parse_mode='HTML'
+    )
+    await state.set_state('importing_questions_file')
+    await state.set_data({'mode': 'check'})
+
+
 @admin.message(StateFilter('importing_questions_file'), F.document, AdminProtect())
 async def process_questions_file(message: Message, state: FSMContext, bot: Bot):
     now = datetime.now()
     print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
-    """Обработка файла с вопросами"""
-    file_path = None
+    """Приём файла с вопросами: сам импорт выполняется фоновой задачей"""
+    upload = None
     try:
         # Проверяем расширение файла
-        if not message.document.file_name.endswith('.xlsx'):
-            await message.answer("❌ Пожалуйста, отправьте файл в формате .xlsx")
-            return
-        
-        # Скачиваем файл
-        file = await bot.get_file(message.document.file_id)
-        file_path = f"temp_questions_{message.from_user.id}.xlsx"
-        await bot.download_file(file.file_path, file_path)
-        
-        # Читаем Excel (без заголовка)
-        df = pd.read_excel(file_path, header=None)
-        
-        if df.empty:
-            await message.answer("❌ Файл пустой!")
+        if not message.document.file_name.lower().endswith(IMPORT_EXTENSIONS):
+            await message.answer("❌ Пожалуйста, отправьте файл в формате .xlsx, .csv, .json, .jsonl или .parquet")
             return
         
-        # Получаем все предметы и темы для проверки
-        all_subjects = await rq.get_subjects()
-        all_themes = await rq.get_themes()
-        
-        # Создаём словари для быстрого поиска
-        subjects_dict = {s.id: s.name for s in all_subjects}
-        themes_dict = {t.id: t for t in all_themes}
-        
-        # Добавляем в БД
-        added = 0
-        skipped = 0
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                # Проверяем количество колонок
-                if len(row) < 9:
-                    errors.append(f"Строка {index+1}: недостаточно колонок (нужно 9)")
-                    skipped += 1
-                    continue
-                
-                # Извлекаем данные
-                subject_id = int(row[0]) if pd.notna(row[0]) else None
-                subject_name = str(row[1]).strip() if pd.notna(row[1]) else None
-                theme_id = int(row[2]) if pd.notna(row[2]) else None
-                theme_name = str(row[3]).strip() if pd.notna(row[3]) else None
-                question_name = str(row[4]).strip() if pd.notna(row[4]) else None
-                question_text = str(row[5]).strip() if pd.notna(row[5]) else None
-                answers_raw = str(row[6]).strip() if pd.notna(row[6]) else None
-                correct_answer = str(row[7]).strip().upper() if pd.notna(row[7]) else None
-                points = int(row[8]) if pd.notna(row[8]) else 10
-                
-                # Валидация
-                if not all([subject_id, theme_id, question_name, question_text, answers_raw, correct_answer]):
-                    errors.append(f"Строка {index+1}: пропущены обязательные поля")
-                    skipped += 1
-                    continue
-                
-                # Проверяем существование предмета
-                if subject_id not in subjects_dict:
-                    errors.append(f"Строка {index+1}: предмет с ID {subject_id} не найден")
-                    skipped += 1
-                    continue
-                
-                # Проверяем существование темы
-                if theme_id not in themes_dict:
-                    errors.append(f"Строка {index+1}: тема с ID {theme_id} не найдена")
-                    skipped += 1
-                    continue
-                
-                # Проверяем соответствие темы предмету
-                if themes_dict[theme_id].subject_id != subject_id:
-                    errors.append(f"Строка {index+1}: тема {theme_id} не принадлежит предмету {subject_id}")
-                    skipped += 1
-                    continue
-                
-                # Разбиваем варианты ответов
-                answers = [a.strip() for a in answers_raw.split('|')]
-                if len(answers) != 4:
-                    errors.append(f"Строка {index+1}: должно быть ровно 4 варианта ответа (через |)")
-                    skipped += 1
-                    continue
-                
-                # Проверяем правильный ответ
-                if correct_answer not in ['А', 'Б', 'В', 'Г']:
-                    errors.append(f"Строка {index+1}: правильный ответ должен быть А, Б, В или Г")
-                    skipped += 1
-                    continue
-                
-                # Проверяем, существует ли уже такой вопрос
-                existing_tests = await rq.get_tests_by_theme_id(theme_id)
-                exists = any(t.name == question_name for t in existing_tests)
-                
-                if exists:
-                    skipped += 1
-                    continue
-                
-                # Добавляем вопрос
-                await rq.add_test(
-                    theme_id=theme_id,
-                    subject_id=subject_id,
-                    name=question_name,
-                    question=question_text,
-                    answer1=answers[0],
-                    answer2=answers[1],
-                    answer3=answers[2],
-                    answer4=answers[3],
-                    point=points,
-                    correct_answer=correct_answer
-                )
-                added += 1
-                
-            except Exception as e:
-                errors.append(f"Строка {index+1}: ошибка обработки - {str(e)}")
-                skipped += 1
-        
-        # Формируем отчёт
-        report = (
-            f"✅ <b>ИМПОРТ ЗАВЕРШЁН!</b>\n\n"
-            f"📊 <b>Статистика:</b>\n"
-            f"• Добавлено вопросов: {added}\n"
-            f"• Пропущено/ошибки: {skipped}\n"
-            f"• Всего обработано: {added + skipped}\n"
-        )
-        
-        if errors:
-            report += f"\n⚠️ <b>Ошибки ({len(errors)}):</b>\n"
-            for error in errors[:5]:  # Показываем первые 5
-                report += f"• {error}\n"
-            if len(errors) > 5:
-                report += f"• ... и ещё {len(errors) - 5}\n"
+        mode = (await state.get_data()).get('mode', 'insert')
+        kind = 'check_questions' if mode == 'check' else 'import_questions'
         
-        await message.answer(report, parse_mode='HTML')
-        
-        # Уведомляем всех пользователей о новых вопросах
-        if added > 0:
-            users = await rq.get_users()
-            for user in users:
-                try:
-                    await bot.send_message(
-                        chat_id=user.tg_id,
-                        text=f'╔═══════════════════════════╗\n'
-                             f'║  🧠 <b>НОВЫЙ ВОПРОС!</b> 🧠   ║\n'
-                             f'╚═══════════════════════════╝\n\n'
-                             f'💡 Добавлено новых вопросов: <b>{added}</b>\n\n'
-                             f'🚀 <b>Проверьте свои знания!</b>\n\n'
-                             f'━━━━━━━━━━━━━━━━━━━━━━━━━━━',
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    print(f"Ошибка отправки сообщения пользователю {user.tg_id}: {e}")
+        # Скачиваем файл в память (освободит его задача импорта, когда закончит)
+        upload = await save_upload(bot, message.document)
         
+        progress = await message.answer(f"⏳ Файл принят, {job_title(kind).lower()} выполняется в фоне...")
+        await job_queue.enqueue(kind, {**upload, 'message_id': progress.message_id, 'mode': mode}, chat_id=message.from_user.id)
         await state.clear()
         
     except Exception as e:
         await message.answer(f"❌ Ошибка при обработке файла: {str(e)}")
         await state.clear()
-    finally:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+        await discard_upload(upload)
+
+
+@job_handler('import_questions', 'Импорт вопросов')
+async def import_questions_job(job):
+    """Обработка файла с вопросами; в режиме upsert изменённые вопросы обновляются, а не пропускаются"""
+    upsert = job.payload.get('mode') == 'upsert'
+    
+    # Получаем все предметы и темы для проверки
+    all_subjects = await rq.get_subjects()
+    all_themes = await rq.get_themes()
+    
+    # Создаём словари для быстрого поиска
+    subjects_dict = {s.id: s.name for s in all_subjects}
+    theme_subjects = {t.id: t.subject_id for t in all_themes}
+    
+    # Добавляем в БД
+    row = job.state.get('row', 0)
+    added = job.state.get('added', 0)
+    updated = job.state.get('updated', 0)
+    unchanged = job.state.get('unchanged', 0)
+    duplicates = job.state.get('duplicates', 0)
+    invalid = job.state.get('invalid', 0)
+    errors = job.state.get('errors', [])  # только первые 5 - для отчёта
+    added_by_subject = job.state.get('added_by_subject', {})  # ключи - str, как после JSON
+    # Все уже существующие вопросы загружаем один раз: (theme_id, название) -> (id, хэш содержимого)
+    stored = await rq.get_test_hashes()
+    seen = set()  # ключи, уже встретившиеся в этом файле
+    
+    # Лист читается потоково: в памяти только текущая пачка строк, сколько бы их ни было в файле
+    reader = await open_table(await upload_source(job.bot, job.payload))
+    # Пачки проверяются целиком, по колонкам, в пуле процессов; дальше идут только прошедшие проверку строки
+    async for row, chunk, (valid, chunk_errors) in map_chunks(reader, PROGRESS_ROWS, validate_questions, subjects_dict, theme_subjects, skip=row):
+        invalid += len(chunk_errors)
+        errors += format_errors(chunk_errors, 5 - len(errors))
+        
+        # Контрольная точка: пачка строк файла пишется одной транзакцией, затем сохраняем, сколько строк разобрано
+        pending = []
+        changed = []
+        for question in valid.to_dict('records'):
+            key = (question['theme_id'], question['name'])
+            if key in seen:
+                # Такой вопрос уже был выше в этом же файле
+                duplicates += 1
+                continue
+            seen.add(key)
+            if key not in stored:
+                pending.append(question)
+                added_by_subject[str(question['subject_id'])] = added_by_subject.get(str(question['subject_id']), 0) + 1
+            elif not upsert:
+                duplicates += 1
+            elif stored[key][1] == test_content_hash(question):
+                unchanged += 1
+            else:
+                changed.append({**question, 'id': stored[key][0]})
+        await rq.upsert_tests_bulk(pending, changed)
+        added += len(pending)
+        updated += len(changed)
+        job.state.update(row=row, added=added, updated=updated, unchanged=unchanged, duplicates=duplicates,
+                         invalid=invalid, errors=errors, added_by_subject=added_by_subject)
+        await job.progress(row, max(reader.total or 0, row))
+    skipped = invalid + duplicates
+    
+    total = added + updated + unchanged + skipped
+    if total == 0:
+        await job.bot.send_message(chat_id=job.chat_id, text="❌ Файл пустой!")
+        return
+    
+    # Формируем отчёт
+    report = (
+        f"✅ <b>ИМПОРТ ЗАВЕРШЁН!</b>\n\n"
+        f"📊 <b>Статистика:</b>\n"
+        f"• Добавлено вопросов: {added}\n"
+    )
+    if upsert:
+        report += (
+            f"• Обновлено: {updated}\n"
+            f"• Без изменений: {unchanged}\n"
+        )
+    report += (
+        f"• Пропущено/ошибки: {skipped}\n"
+        f"• Всего обработано: {total}\n"
+    )
+    
+    if errors:
+        report += f"\n⚠️ <b>Ошибки ({invalid}):</b>\n"
+        for error in errors:  # Показываем первые 5
+            report += f"• {error}\n"
+        if invalid > 5:
+            report += f"• ... и ещё {invalid - 5}\n"
+    
+    await job.bot.send_message(chat_id=job.chat_id, text=report, parse_mode='HTML')
+    
+    # Уведомляем о новых вопросах тех, кто занимается этими предметами
+    for subject_id, subject_added in added_by_subject.items():
+        await notify_users(
+            report_chat_id=job.chat_id,
+            kind='question',
+            count=subject_added,
+            segment={'subject_id': int(subject_id)},
+            text=f'╔═══════════════════════════╗\n'
+                 f'║  🧠 <b>НОВЫЙ ВОПРОС!</b> 🧠   ║\n'
+                 f'╚═══════════════════════════╝\n\n'
+                 f'📚 <b>Предмет:</b> {subjects_dict[int(subject_id)]}\n'
+                 f'💡 Добавлено новых вопросов: <b>{subject_added}</b>\n\n'
+                 f'🚀 <b>Проверьте свои знания!</b>\n\n'
+                 f'━━━━━━━━━━━━━━━━━━━━━━━━━━━'
+        )
+
+
+@job_handler('check_questions', 'Проверка файла вопросов')
+async def check_questions_job(job):
+    """Проверка файла с вопросами без записи в БД: все ошибки по строкам - в отчёте Excel"""
+    subject_ids = [s.id for s in await rq.get_subjects()]
+    theme_subjects = {t.id: t.subject_id for t in await rq.get_themes()}
+    stored = await rq.get_test_hashes()
+    
+    seen = {}  # (theme_id, название) -> строка файла, где вопрос встретился впервые
+    checked = 0
+    existing = 0
+    report = ReportWorkbook('Ошибки', ['Строка', 'Ошибка'] + [f'Колонка {column}' for column in 'ABCDEFGHI'])
+    
+    # Отчёт не сохраняется между перезапусками, поэтому файл всегда проверяется с начала
+    reader = await open_table(await upload_source(job.bot, job.payload))
+    async for row, chunk, (valid, errors) in map_chunks(reader, PROGRESS_ROWS, validate_questions, subject_ids, theme_subjects):
+        problems = errors['error'].to_dict()  # номер строки -> причина
+        for index, theme_id, name in zip(valid.index, valid['theme_id'], valid['name']):
+            key = (theme_id, name)
+            if key in seen:
+                problems[index] = f"повторяет вопрос из строки {seen[key] + 1}"
+                continue
+            seen[key] = index
+            if key in stored:
+                existing += 1
+        
+        cells = chunk.astype(object).where(chunk.notna(), None)
+        await report.append([[index + 1, problems[index]] + cells.loc[index].tolist() for index in sorted(problems)])
+        checked += len(chunk)
+        await job.progress(row, max(reader.total or 0, row))
+    
+    if checked == 0:
+        await job.bot.send_message(chat_id=job.chat_id, text="❌ Файл пустой!")
+        return
+    
+    text = (
+        f"🔍 <b>ПРОВЕРКА ЗАВЕРШЕНА</b> (в базу ничего не записано)\n\n"
+        f"📊 <b>Статистика:</b>\n"
+        f"• Строк проверено: {checked}\n"
+        f"• Без ошибок: {checked - report.rows}\n"
+        f"• Из них уже есть в базе: {existing}\n"
+        f"• С ошибками: {report.rows}\n"
+    )
+    if report.rows == 0:
+        await job.bot.send_message(chat_id=job.chat_id, text=text + "\n✅ Файл можно импортировать.", parse_mode='HTML')
+        return
+    
+    await job.bot.send_document(
+        chat_id=job.chat_id,
+        document=BufferedInputFile(await report.save(), filename='errors_questions.xlsx'),
+        caption=text + "\n📄 Все ошибки с номерами строк - в файле.",
+        parse_mode='HTML'
+    )
 
 
 async def create_questions_example():
@@ -650,7 +695,7 @@ async def create_questions_example():
         df = pd.DataFrame(data)
         
         filename = 'example_questions.xlsx'
-        df.to_excel(filename, index=False, header=False)
+        await write_excel(df, filename, index=False, header=False)
         return filename
         
     except Exception as e:
@@ -675,10 +720,168 @@ async def create_questions_example():
         }
         df = pd.DataFrame(data)
         filename = 'example_questions.xlsx'
-        df.to_excel(filename, index=False, header=False)
+        await write_excel(df, filename, index=False, header=False)
         return filename
 
 
+# ===== РАССЫЛКА ПО СЕГМЕНТАМ =====
+
+@admin.message(F.text == '📢 Рассылка', AdminProtect())
+async def start_broadcast(message: Message, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    await message.answer("📢 Кому отправить сообщение?", reply_markup=kb.segments_kb)
+    await state.set_state('choosing_segment')
+
+
+async def ask_broadcast_text(message: Message, state: FSMContext, segment):
+    """Сегмент выбран: показываем число получателей и просим текст"""
+    recipients = await rq.count_users(active_only=True, segment=segment)
+    await state.update_data(segment=segment)
+    await message.answer(f"👥 Получателей: {recipients}\n\n✍️ Введите текст рассылки:")
+    await state.set_state('broadcast_text')
+
+
+@admin.callback_query(F.data == 'segment_all', StateFilter('choosing_segment'), AdminProtect())
+async def segment_all(callback: CallbackQuery, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    await callback.answer()
+    await ask_broadcast_text(callback.message, state, None)
+
+
+@admin.callback_query(F.data == 'segment_subject', StateFilter('choosing_segment'), AdminProtect())
+async def segment_subject(callback: CallbackQuery, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    await callback.answer()
+    await callback.message.answer("📚 Выберите ID предмета:", reply_markup=await kb.subjects_id())
+    await state.set_state('segment_subject')
+
+
+@admin.callback_query(F.data.startswith('subject_'), StateFilter('segment_subject'), AdminProtect())
+async def segment_subject_selected(callback: CallbackQuery, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    await callback.answer()
+    await ask_broadcast_text(callback.message, state, {'subject_id': int(callback.data.split('_')[1])})
+
+
+@admin.callback_query(F.data == 'segment_theme', StateFilter('choosing_segment'), AdminProtect())
+async def segment_theme(callback: CallbackQuery, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    await callback.answer()
+    await callback.message.answer("📖 Выберите ID темы:", reply_markup=await kb.themes_id())
+    await state.set_state('segment_theme')
+
+
+@admin.callback_query(F.data.startswith('theme_'), StateFilter('segment_theme'), AdminProtect())
+async def segment_theme_selected(callback: CallbackQuery, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    await callback.answer()
+    await state.update_data(theme_id=int(callback.data.split('_')[1]))
+    await callback.message.answer("🎯 Больше скольких ошибок в теме должно быть у пользователя?")
+    await state.set_state('segment_min_errors')
+
+
+@admin.message(StateFilter('segment_min_errors'), AdminProtect())
+async def segment_min_errors(message: Message, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    if not message.text or not message.text.isdigit():
+        await message.answer("⚠️ Введите целое число.")
+        return
+    data = await state.get_data()
+    await ask_broadcast_text(message, state, {'theme_id': data['theme_id'], 'min_errors': int(message.text)})
+
+
+@admin.callback_query(F.data == 'segment_inactive', StateFilter('choosing_segment'), AdminProtect())
+async def segment_inactive(callback: CallbackQuery, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    await callback.answer()
+    await callback.message.answer("💤 Сколько дней пользователь не заходил? (например, 30)")
+    await state.set_state('segment_inactive_days')
+
+
+@admin.message(StateFilter('segment_inactive_days'), AdminProtect())
+async def segment_inactive_days(message: Message, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    if not message.text or not message.text.isdigit():
+        await message.answer("⚠️ Введите целое число дней.")
+        return
+    await ask_broadcast_text(message, state, {'inactive_days': int(message.text)})
+
+
+@admin.message(StateFilter('broadcast_text'), AdminProtect())
+async def send_broadcast(message: Message, state: FSMContext):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    if not message.text:
+        await message.answer("⚠️ Отправьте текст сообщения.")
+        return
+    data = await state.get_data()
+    await notify_users(message.html_text, report_chat_id=message.from_user.id, segment=data.get('segment'))
+    await message.answer("✅ Рассылка поставлена в очередь. Отчёт придёт, когда она закончится.")
+    await state.clear()
+
+
+# ===== ФОНОВЫЕ ЗАДАЧИ =====
+
+async def jobs_report():
+    """Последние фоновые задачи с прогрессом"""
+    jobs = await rq.get_jobs()
+    if not jobs:
+        return "📭 Фоновых задач пока не было.", kb.jobs_kb(jobs)
+    text = "⏳ <b>ФОНОВЫЕ ЗАДАЧИ</b>\n\n"
+    for job in jobs:
+        text += f"#{job.id} {job_title(job.kind)} - {STATUS_TITLES.get(job.status, job.status)}"
+        if job.total:
+            text += f" ({job.done} из {job.total})"
+        text += "\n"
+    return text, kb.jobs_kb(jobs)
+
+
+@admin.message(F.text == '⏳ Фоновые задачи', AdminProtect())
+async def show_jobs(message: Message):
+    now = datetime.now()
+    print(f'Admin {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {message.text}')
+    text, markup = await jobs_report()
+    await message.answer(text, reply_markup=markup, parse_mode='HTML')
+
+
+@admin.callback_query(F.data == 'refresh_jobs', AdminProtect())
+async def refresh_jobs(callback: CallbackQuery):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    text, markup = await jobs_report()
+    await callback.answer()
+    try:
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    except TelegramBadRequest:
+        pass  # ничего не изменилось
+
+
+@admin.callback_query(F.data.startswith('cancel_job_'), AdminProtect())
+async def cancel_job(callback: CallbackQuery):
+    now = datetime.now()
+    print(f'Admin {callback.from_user.first_name}({callback.from_user.id}) send callback at Дата: {now.strftime("%d.%m.%Y")}, Время: {now.strftime("%H:%M:%S")}: {callback.data}')
+    job_id = int(callback.data.split('_')[2])
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        await callback.answer(f"⚠️ Задача #{job_id} уже завершена.")
+    else:
+        await callback.answer(f"🚫 Задача #{job_id} отменена.")
+    text, markup = await jobs_report()
+    try:
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode='HTML')
+    except TelegramBadRequest:
+        pass
+
+
 # Отменить импорт
 @admin.message(F.text == '❌ Отмена', StateFilter('importing_subjects_file', 'importing_themes_file', 'selecting_subject_for_import', 'importing_questions_file'), AdminProtect())
 async def cancel_import(message: Message, state: FSMContext):
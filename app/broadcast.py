@@ -0,0 +1,282 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import app.database.requests as rq
+from app.jobs import job_handler, job_queue
+
+import asyncio
+import os
+import time
+
+
+# Лимиты Bot API: ~30 сообщений в секунду на бота и не чаще 1 сообщения в секунду в один чат
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 10))
+CHAT_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+# Окно дайджеста в секундах: новости о контенте за это время уходят одним сообщением (0 - сразу)
+DIGEST_WINDOW = int(os.getenv('DIGEST_WINDOW', 0))
+
+DIGEST_TITLES = {
+    'subject': '📚 Новых предметов',
+    'theme': '📖 Новых тем',
+    'question': '🧠 Новых вопросов',
+}
+
+
+class RateLimiter:
+    """Равномерно распределяет отправки: не больше rate сообщений в секунду"""
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Telegram попросил подождать (RetryAfter) - сдвигаем все следующие отправки"""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class ChatLimiter:
+    """Не даёт отправить в один чат чаще, чем раз в interval секунд"""
+    def __init__(self, interval=CHAT_INTERVAL, max_chats=10000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._last_sent = {}
+
+    async def wait(self, chat_id):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._last_sent[chat_id] = time.monotonic()
+        if len(self._last_sent) > self.max_chats:
+            border = time.monotonic() - self.interval
+            self._last_sent = {chat: sent for chat, sent in self._last_sent.items() if sent > border}
+
+
+global_limiter = RateLimiter(BROADCAST_RATE)
+chat_limiter = ChatLimiter()
+
+
+class BroadcastStats:
+    def __init__(self):
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.deactivated = 0
+        self.unreachable = []  # чаты, куда писать больше нельзя
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name, value in data.items():
+            setattr(stats, name, value)
+        return stats
+
+    def as_dict(self):
+        return {'total': self.total, 'sent': self.sent, 'failed': self.failed, 'retried': self.retried,
+                'deactivated': self.deactivated, 'elapsed': self.elapsed}
+
+    def add(self, other):
+        self.total += other.total
+        self.sent += other.sent
+        self.failed += other.failed
+        self.retried += other.retried
+        self.deactivated += other.deactivated
+        self.elapsed += other.elapsed
+
+    @property
+    def rate(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        return (
+            f'📢 <b>Рассылка завершена</b>\n\n'
+            f'• Получателей: {self.total}\n'
+            f'• Доставлено: {self.sent}\n'
+            f'• Ошибок: {self.failed}\n'
+            f'• Повторов после RetryAfter: {self.retried}\n'
+            f'• Заблокировали бота (больше не получат рассылки): {self.deactivated}\n'
+            f'• Время: {self.elapsed:.1f} с ({self.rate:.1f} сообщ./с)'
+        )
+
+
+def is_unreachable(error):
+    """Пользователь заблокировал бота, удалил аккаунт или чат не существует"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and 'chat not found' in error.message.lower()
+
+
+async def send_with_limits(bot: Bot, chat_id, text, parse_mode, stats):
+    for attempt in range(MAX_ATTEMPTS):
+        await chat_limiter.wait(chat_id)
+        await global_limiter.wait()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+            stats.sent += 1
+            return
+        except TelegramRetryAfter as e:
+            stats.retried += 1
+            global_limiter.pause(e.retry_after)
+        except Exception as e:
+            if is_unreachable(e):
+                stats.unreachable.append(chat_id)
+            else:
+                print(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+            stats.failed += 1
+            return
+    stats.failed += 1
+
+
+async def broadcast(bot: Bot, chat_ids, text, parse_mode='HTML', concurrency=BROADCAST_CONCURRENCY):
+    """Отправляет один и тот же текст всем chat_ids (обычный или асинхронный итератор)"""
+    stats = BroadcastStats()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            await send_with_limits(bot, chat_id, text, parse_mode, stats)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        if hasattr(chat_ids, '__aiter__'):
+            async for chat_id in chat_ids:
+                stats.total += 1
+                await queue.put(chat_id)
+        else:
+            for chat_id in chat_ids:
+                stats.total += 1
+                await queue.put(chat_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    stats.elapsed = time.monotonic() - stats.started
+    if stats.unreachable:
+        await rq.deactivate_users(stats.unreachable)
+        stats.deactivated = len(stats.unreachable)
+    return stats
+
+
+@job_handler('notify', 'Рассылка')
+async def notify_job(job):
+    """Рассылка из очереди: пачками по USERS_CHUNK_SIZE, после перезапуска продолжается с места остановки"""
+    text = job.payload['text']
+    stats = BroadcastStats.from_dict(job.state.get('stats', {}))
+    if 'chat_ids' in job.payload:
+        stats.add(await broadcast(job.bot, job.payload['chat_ids'], text))
+        await job.progress(stats.total, stats.total)
+    else:
+        segment = job.payload.get('segment')
+        total = await rq.count_users(active_only=True, segment=segment)
+        async for users in rq.iter_user_chunks(active_only=True, after_id=job.state.get('last_id', 0), segment=segment):
+            stats.add(await broadcast(job.bot, [user.tg_id for user in users], text))
+            job.state['last_id'] = users[-1].id
+            job.state['stats'] = stats.as_dict()
+            await job.progress(stats.total, total)
+    await send_report(job, stats)
+
+
+async def send_report(job, stats):
+    if job.chat_id is not None:
+        try:
+            await job.bot.send_message(chat_id=job.chat_id, text=stats.report(), parse_mode='HTML')
+        except TelegramAPIError as e:
+            print(f"Ошибка отправки отчёта о рассылке {job.chat_id}: {e}")
+
+
+async def notify_users(text, report_chat_id=None, kind=None, count=1, name=None, segment=None):
+    """Ставит в очередь рассылку пользователям сегмента (по умолчанию - всем); отчёт получит report_chat_id.
+
+    Новости о контенте (kind: subject, theme, question) в режиме дайджеста копятся
+    и уходят одним сообщением на пользователя за окно DIGEST_WINDOW.
+    """
+    subject_id = segment.get('subject_id') if segment else None
+    if kind is None or DIGEST_WINDOW <= 0 or (segment and subject_id is None):
+        payload = {'text': text, 'segment': segment} if segment else {'text': text}
+        return await job_queue.enqueue('notify', payload, chat_id=report_chat_id)
+    await rq.add_content_event(kind, count, name, subject_id)
+    if not await rq.has_pending_job('digest'):
+        await job_queue.enqueue('digest', {}, chat_id=report_chat_id, delay=DIGEST_WINDOW)
+
+
+def render_digest(events):
+    totals = {}
+    names = {}
+    for event in events:
+        totals[event['kind']] = totals.get(event['kind'], 0) + event['count']
+        if event['name']:
+            names.setdefault(event['kind'], []).append(event['name'])
+    text = '╔═══════════════════════════╗\n║  📬 <b>ЧТО НОВОГО?</b> 📬  ║\n╚═══════════════════════════╝\n\n'
+    for kind, title in DIGEST_TITLES.items():
+        if kind not in totals:
+            continue
+        text += f'{title}: <b>{totals[kind]}</b>\n'
+        for name in names.get(kind, [])[:5]:
+            text += f'   • <code>{name}</code>\n'
+        if len(names.get(kind, [])) > 5:
+            text += f'   • ... и ещё {len(names[kind]) - 5}\n'
+    return text + '\n🚀 <b>Проверьте свои знания!</b>'
+
+
+@job_handler('digest', 'Дайджест новостей')
+async def digest_job(job):
+    """Одно сообщение на пользователя за окно: общие новости и новости предметов, которые он проходил"""
+    if 'events' not in job.state:
+        # Забранные события хранятся в состоянии задачи: после перезапуска дайджест продолжится с ними же
+        job.state['events'] = [
+            {'kind': event.kind, 'name': event.name, 'count': event.count, 'subject_id': event.subject_id}
+            for event in await rq.pop_content_events()
+        ]
+        await job.progress(0)
+    events = job.state['events']
+    if not events:
+        return
+    subject_ids = sorted({event['subject_id'] for event in events if event['subject_id'] is not None})
+    has_common = any(event['subject_id'] is None for event in events)
+
+    # Без общих новостей дайджест нужен только тем, кто проходил предметы из новостей
+    segment = None if has_common else {'subject_ids': subject_ids}
+    total = await rq.count_users(active_only=True, segment=segment)
+    stats = BroadcastStats.from_dict(job.state.get('stats', {}))
+    texts = {}  # набор предметов пользователя -> текст дайджеста
+    async for users in rq.iter_user_chunks(active_only=True, after_id=job.state.get('last_id', 0), segment=segment):
+        studied = await rq.get_studied_subjects([user.id for user in users], subject_ids) if subject_ids else {}
+        recipients = {}
+        for user in users:
+            subjects = frozenset(studied.get(user.id, ()))
+            if has_common or subjects:
+                recipients.setdefault(subjects, []).append(user.tg_id)
+        for subjects, chat_ids in recipients.items():
+            if subjects not in texts:
+                texts[subjects] = render_digest([
+                    event for event in events if event['subject_id'] is None or event['subject_id'] in subjects
+                ])
+            stats.add(await broadcast(job.bot, chat_ids, texts[subjects]))
+        job.state['last_id'] = users[-1].id
+        job.state['stats'] = stats.as_dict()
+        await job.progress(stats.total, total)
+    await send_report(job, stats)
+
+
+async def notify_chats(chat_ids, text):
+    """Ставит в очередь рассылку по заранее известному списку чатов (например, администраторам)"""
+    return await job_queue.enqueue('notify', {'text': text, 'chat_ids': list(chat_ids)})
@@ -3,11 +3,13 @@ from aiogram.filters import StateFilter
 from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 import pandas as pd
-import os
 
 from app.custom_filters import AdminProtect
 import app.database.requests as rq
 import app.keyboards as kb
+from app.broadcast import notify_users
+from app.jobs import job_handler, job_queue, PROGRESS_ROWS
+from app.files import IMPORT_EXTENSIONS, open_table, write_excel, remove_file, save_upload, upload_source, discard_upload
 
 
 bulk_import = Router()
@@ -20,7 +22,7 @@ async def start_subjects_import(message: Message, state: FSMContext):
     """Начало процесса массового импорта предметов"""
     await message.answer(
         "📁 <b>МАССОВЫЙ ИМПОРТ ПРЕДМЕТОВ</b>\n\n"
-        "Отправьте Excel файл (.xlsx) с предметами.\n\n"
+        "Отправьте файл с предметами: Excel (.xlsx), CSV, JSON Lines или Parquet.\n\n"
         "<b>Формат файла:</b>\n"
         "• Колонка A: Название предмета\n"
         "• Без заголовков - сразу данные\n\n"
@@ -33,108 +35,114 @@ async def start_subjects_import(message: Message, state: FSMContext):
     )
     
     # Создаём и отправляем пример файла
-    example_file = create_subjects_example()
+    example_file = await create_subjects_example()
     await message.answer_document(
         FSInputFile(example_file),
         caption="📄 Пример файла для импорта предметов"
     )
-    os.remove(example_file)
+    await remove_file(example_file)
     
     await state.set_state('importing_subjects_file')
 
 
 @bulk_import.message(StateFilter('importing_subjects_file'), F.document, AdminProtect())
 async def process_subjects_file(message: Message, state: FSMContext, bot: Bot):
-    """Обработка файла с предметами"""
-    file_path = None
+    """Приём файла с предметами: сам импорт выполняется фоновой задачей"""
+    upload = None
     try:
         # Проверяем расширение файла
-        if not message.document.file_name.endswith('.xlsx'):
-            await message.answer("❌ Пожалуйста, отправьте файл в формате .xlsx")
+        if not message.document.file_name.lower().endswith(IMPORT_EXTENSIONS):
+            await message.answer("❌ Пожалуйста, отправьте файл в формате .xlsx, .csv, .json, .jsonl или .parquet")
             return
         
-        # Скачиваем файл
-        file = await bot.get_file(message.document.file_id)
-        file_path = f"temp_subjects_{message.from_user.id}.xlsx"
-        await bot.download_file(file.file_path, file_path)
-        
-        # Читаем Excel (без заголовка)
-        df = pd.read_excel(file_path, header=None)
-        subjects = df[0].dropna().tolist()
-        
-        if not subjects:
-            await message.answer("❌ Файл пустой или неправильного формата!")
-            return
+        # Скачиваем файл в память (освободит его задача импорта, когда закончит)
+        upload = await save_upload(bot, message.document)
         
-        # Добавляем в БД
-        added = 0
-        skipped = 0
-        skipped_names = []
+        progress = await message.answer("⏳ Файл принят, импорт предметов выполняется в фоне...")
+        await job_queue.enqueue('import_subjects', {**upload, 'message_id': progress.message_id}, chat_id=message.from_user.id)
+        await state.clear()
         
-        for subject_name in subjects:
-            subject_name = str(subject_name).strip()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при обработке файла: {str(e)}")
+        await state.clear()
+        await discard_upload(upload)
+
+
+@job_handler('import_subjects', 'Импорт предметов')
+async def import_subjects_job(job):
+    """Обработка файла с предметами"""
+    # Добавляем в БД
+    added = job.state.get('added', 0)
+    skipped = job.state.get('skipped', 0)
+    skipped_names = job.state.get('skipped_names', [])  # только первые 5 - для отчёта
+    
+    # Существующие названия загружаем один раз; принятые строки дописываются сюда же
+    known_subjects = {subject.name for subject in await rq.get_subjects()}
+    
+    # Лист читается потоково: в памяти только текущая пачка строк
+    reader = await open_table(await upload_source(job.bot, job.payload))
+    async for row, chunk in reader.chunks(PROGRESS_ROWS, skip=job.state.get('row', 0)):
+        pending = []  # новые предметы пачки, которые запишутся одной транзакцией
+        for value in chunk[0].dropna():
+            subject_name = str(value).strip()
             if not subject_name:
                 continue
             
-            # Проверяем, существует ли предмет
-            all_subjects = await rq.get_subjects()
-            existing = any(s.name == subject_name for s in all_subjects)
-            
-            if existing:
+            # Проверяем, существует ли предмет (в БД или выше в этом же файле)
+            if subject_name in known_subjects:
                 skipped += 1
-                skipped_names.append(subject_name)
+                if len(skipped_names) < 5:
+                    skipped_names.append(subject_name)
                 continue
             
-            # Добавляем новый предмет
-            await rq.add_subject(subject_name)
+            # Добавляем новый предмет в пачку
+            pending.append(subject_name)
+            known_subjects.add(subject_name)
             added += 1
         
-        # Формируем отчёт
-        report = (
-            f"✅ <b>ИМПОРТ ЗАВЕРШЁН!</b>\n\n"
-            f"📊 <b>Статистика:</b>\n"
-            f"• Добавлено: {added}\n"
-            f"• Пропущено (уже существуют): {skipped}\n"
-            f"• Всего обработано: {added + skipped}\n"
+        # Контрольная точка: пишем пачку и сохраняем, сколько строк уже разобрано
+        await rq.add_subjects_bulk(pending)
+        job.state.update(row=row, added=added, skipped=skipped, skipped_names=skipped_names)
+        await job.progress(row, max(reader.total or 0, row))
+    
+    if added + skipped == 0:
+        await job.bot.send_message(chat_id=job.chat_id, text="❌ Файл пустой или неправильного формата!")
+        return
+    
+    # Формируем отчёт
+    report = (
+        f"✅ <b>ИМПОРТ ЗАВЕРШЁН!</b>\n\n"
+        f"📊 <b>Статистика:</b>\n"
+        f"• Добавлено: {added}\n"
+        f"• Пропущено (уже существуют): {skipped}\n"
+        f"• Всего обработано: {added + skipped}\n"
+    )
+    
+    if skipped_names:
+        report += f"\n⚠️ <b>Пропущенные предметы:</b>\n"
+        for name in skipped_names:  # Показываем первые 5
+            report += f"• {name}\n"
+        if skipped > 5:
+            report += f"• ... и ещё {skipped - 5}\n"
+    
+    await job.bot.send_message(chat_id=job.chat_id, text=report, parse_mode='HTML')
+    
+    # Уведомляем всех пользователей о новых предметах
+    if added > 0:
+        await notify_users(
+            report_chat_id=job.chat_id,
+            kind='subject',
+            count=added,
+            text=f'╔═══════════════════════════╗\n'
+                 f'║  🚀 <b>ГОРЯЧИЕ НОВОСТИ!</b> 🚀  ║\n'
+                 f'╚═══════════════════════════╝\n\n'
+                 f'✨ <i>Специально для вас!</i> ✨\n\n'
+                 f'📚 <b>Добавлено {added} новых предметов!</b>\n\n'
+                 f'🎯 Спешите изучить!\n'
+                 f'💡 Не пропустите интересный контент!\n\n'
+                 f'⚡ <b>Начните изучение прямо сейчас!</b>'
         )
-        
-        if skipped_names:
-            report += f"\n⚠️ <b>Пропущенные предметы:</b>\n"
-            for name in skipped_names[:5]:  # Показываем первые 5
-                report += f"• {name}\n"
-            if len(skipped_names) > 5:
-                report += f"• ... и ещё {len(skipped_names) - 5}\n"
-        
-        await message.answer(report, parse_mode='HTML')
-        
-        # Уведомляем всех пользователей о новых предметах
-        if added > 0:
-            users = await rq.get_users()
-            for user in users:
-                try:
-                    await bot.send_message(
-                        chat_id=user.tg_id,
-                        text=f'╔═══════════════════════════╗\n'
-                             f'║  🚀 <b>ГОРЯЧИЕ НОВОСТИ!</b> 🚀  ║\n'
-                             f'╚═══════════════════════════╝\n\n'
-                             f'✨ <i>Специально для вас!</i> ✨\n\n'
-                             f'📚 <b>Добавлено {added} новых предметов!</b>\n\n'
-                             f'🎯 Спешите изучить!\n'
-                             f'💡 Не пропустите интересный контент!\n\n'
-                             f'⚡ <b>Начните изучение прямо сейчас!</b>',
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    print(f"Ошибка отправки сообщения пользователю {user.tg_id}: {e}")
-        
-        await state.clear()
-        
-    except Exception as e:
-        await message.answer(f"❌ Ошибка при обработке файла: {str(e)}")
-        await state.clear()
-    finally:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+    
 
 
 # ===== ИМПОРТ ТЕМ =====
@@ -175,7 +183,7 @@ async def subject_selected_for_import(callback: CallbackQuery, state: FSMContext
     await callback.message.answer(
         f"📁 <b>МАССОВЫЙ ИМПОРТ ТЕМ</b>\n\n"
         f"📚 Предмет: <b>{subject.name}</b>\n\n"
-        f"Отправьте Excel файл (.xlsx) с темами.\n\n"
+        f"Отправьте файл с темами: Excel (.xlsx), CSV, JSON Lines или Parquet.\n\n"
         f"<b>Формат файла:</b>\n"
         f"• Колонка A: Название темы\n"
         f"• Колонка B: Описание темы (опционально)\n"
@@ -187,12 +195,12 @@ async def subject_selected_for_import(callback: CallbackQuery, state: FSMContext
     )
     
     # Создаём и отправляем пример файла
-    example_file = create_themes_example()
+    example_file = await create_themes_example()
     await callback.message.answer_document(
         FSInputFile(example_file),
         caption="📄 Пример файла для импорта тем"
     )
-    os.remove(example_file)
+    await remove_file(example_file)
     
     await state.set_state('importing_themes_file')
     await callback.answer()
@@ -200,115 +208,130 @@ async def subject_selected_for_import(callback: CallbackQuery, state: FSMContext
 
 @bulk_import.message(StateFilter('importing_themes_file'), F.document, AdminProtect())
 async def process_themes_file(message: Message, state: FSMContext, bot: Bot):
-    """Обработка файла с темами"""
-    file_path = None
+    """Приём файла с темами: сам импорт выполняется фоновой задачей"""
+    upload = None
     try:
         data = await state.get_data()
         subject_id = data['subject_id']
         subject_name = data['subject_name']
         
         # Проверяем расширение файла
-        if not message.document.file_name.endswith('.xlsx'):
-            await message.answer("❌ Пожалуйста, отправьте файл в формате .xlsx")
+        if not message.document.file_name.lower().endswith(IMPORT_EXTENSIONS):
+            await message.answer("❌ Пожалуйста, отправьте файл в формате .xlsx, .csv, .json, .jsonl или .parquet")
             return
         
-        # Скачиваем файл
-        file = await bot.get_file(message.document.file_id)
-        file_path = f"temp_themes_{message.from_user.id}.xlsx"
-        await bot.download_file(file.file_path, file_path)
+        # Скачиваем файл в память (освободит его задача импорта, когда закончит)
+        upload = await save_upload(bot, message.document)
         
-        # Читаем Excel (без заголовка)
-        df = pd.read_excel(file_path, header=None)
-        
-        if df.empty:
-            await message.answer("❌ Файл пустой!")
-            return
-        
-        # Добавляем в БД
-        added = 0
-        skipped = 0
-        skipped_names = []
+        progress = await message.answer("⏳ Файл принят, импорт тем выполняется в фоне...")
+        await job_queue.enqueue(
+            'import_themes',
+            {**upload, 'message_id': progress.message_id, 'subject_id': subject_id, 'subject_name': subject_name},
+            chat_id=message.from_user.id
+        )
+        await state.clear()
         
-        for index, row in df.iterrows():
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при обработке файла: {str(e)}")
+        await state.clear()
+        await discard_upload(upload)
+
+
+@job_handler('import_themes', 'Импорт тем')
+async def import_themes_job(job):
+    """Обработка файла с темами"""
+    subject_id = job.payload['subject_id']
+    subject_name = job.payload['subject_name']
+    
+    # Добавляем в БД
+    added = job.state.get('added', 0)
+    skipped = job.state.get('skipped', 0)
+    skipped_names = job.state.get('skipped_names', [])  # только первые 5 - для отчёта
+    
+    # Существующие (subject_id, название) загружаем один раз; принятые строки дописываются сюда же
+    known_themes = {(theme.subject_id, theme.name) for theme in await rq.get_themes_by_subject(subject_id)}
+    
+    # Лист читается потоково: в памяти только текущая пачка строк
+    reader = await open_table(await upload_source(job.bot, job.payload))
+    async for row, chunk in reader.chunks(PROGRESS_ROWS, skip=job.state.get('row', 0)):
+        pending = []  # новые темы пачки, которые запишутся одной транзакцией
+        for values in chunk.itertuples(index=False):
             # Название темы из колонки A
-            theme_name = str(row[0]).strip() if pd.notna(row[0]) else None
+            theme_name = str(values[0]).strip() if pd.notna(values[0]) else None
             
             if not theme_name:
                 continue
             
             # Описание из колонки B (если есть)
-            theme_description = str(row[1]).strip() if len(row) > 1 and pd.notna(row[1]) else "Описание будет добавлено позже."
+            theme_description = str(values[1]).strip() if len(values) > 1 and pd.notna(values[1]) else "Описание будет добавлено позже."
             
-            # Проверяем, существует ли тема
-            existing_themes = await rq.get_themes_by_subject(subject_id)
-            existing = any(t.name == theme_name for t in existing_themes)
-            
-            if existing:
+            # Проверяем, существует ли тема (в БД или выше в этом же файле)
+            if (subject_id, theme_name) in known_themes:
                 skipped += 1
-                skipped_names.append(theme_name)
+                if len(skipped_names) < 5:
+                    skipped_names.append(theme_name)
                 continue
             
-            # Добавляем новую тему
-            await rq.add_theme(
-                subject_id=subject_id,
-                name=theme_name,
-                description=theme_description
-            )
+            # Добавляем новую тему в пачку
+            pending.append({
+                'subject_id': subject_id,
+                'name': theme_name,
+                'description': theme_description
+            })
+            known_themes.add((subject_id, theme_name))
             added += 1
         
-        # Формируем отчёт
-        report = (
-            f"✅ <b>ИМПОРТ ЗАВЕРШЁН!</b>\n\n"
-            f"📚 Предмет: <b>{subject_name}</b>\n\n"
-            f"📊 <b>Статистика:</b>\n"
-            f"• Добавлено тем: {added}\n"
-            f"• Пропущено (уже существуют): {skipped}\n"
-            f"• Всего обработано: {added + skipped}\n"
+        # Контрольная точка: пишем пачку и сохраняем, сколько строк уже разобрано
+        await rq.add_themes_bulk(pending)
+        job.state.update(row=row, added=added, skipped=skipped, skipped_names=skipped_names)
+        await job.progress(row, max(reader.total or 0, row))
+    
+    if added + skipped == 0:
+        await job.bot.send_message(chat_id=job.chat_id, text="❌ Файл пустой!")
+        return
+    
+    # Формируем отчёт
+    report = (
+        f"✅ <b>ИМПОРТ ЗАВЕРШЁН!</b>\n\n"
+        f"📚 Предмет: <b>{subject_name}</b>\n\n"
+        f"📊 <b>Статистика:</b>\n"
+        f"• Добавлено тем: {added}\n"
+        f"• Пропущено (уже существуют): {skipped}\n"
+        f"• Всего обработано: {added + skipped}\n"
+    )
+    
+    if skipped_names:
+        report += f"\n⚠️ <b>Пропущенные темы:</b>\n"
+        for name in skipped_names:
+            report += f"• {name}\n"
+        if skipped > 5:
+            report += f"• ... и ещё {skipped - 5}\n"
+    
+    await job.bot.send_message(chat_id=job.chat_id, text=report, parse_mode='HTML')
+    
+    # Уведомляем о новых темах тех, кто занимается этим предметом
+    if added > 0:
+        await notify_users(
+            report_chat_id=job.chat_id,
+            kind='theme',
+            count=added,
+            segment={'subject_id': subject_id},
+            text=f'╔═══════════════════════════╗\n'
+                 f'║  ⭐ <b>НОВАЯ ТЕМА!</b> ⭐  ║\n'
+                 f'╚═══════════════════════════╝\n\n'
+                 f'🎓 <i>Добавлен свежий материал!</i> 🎓\n\n'
+                 f'📚 <b>Предмет:</b> {subject_name}\n'
+                 f'📖 <b>Новых тем:</b> {added}\n\n'
+                 f'🚀 Начните обучение сейчас!\n'
+                 f'💪 Расширяйте свои знания!\n\n'
+                 f'⚡ <b>Уровень мастерства ждёт вас!</b>'
         )
-        
-        if skipped_names:
-            report += f"\n⚠️ <b>Пропущенные темы:</b>\n"
-            for name in skipped_names[:5]:
-                report += f"• {name}\n"
-            if len(skipped_names) > 5:
-                report += f"• ... и ещё {len(skipped_names) - 5}\n"
-        
-        await message.answer(report, parse_mode='HTML')
-        
-        # Уведомляем всех пользователей о новых темах
-        if added > 0:
-            users = await rq.get_users()
-            for user in users:
-                try:
-                    await bot.send_message(
-                        chat_id=user.tg_id,
-                        text=f'╔═══════════════════════════╗\n'
-                             f'║  ⭐ <b>НОВАЯ ТЕМА!</b> ⭐  ║\n'
-                             f'╚═══════════════════════════╝\n\n'
-                             f'🎓 <i>Добавлен свежий материал!</i> 🎓\n\n'
-                             f'📚 <b>Предмет:</b> {subject_name}\n'
-                             f'📖 <b>Новых тем:</b> {added}\n\n'
-                             f'🚀 Начните обучение сейчас!\n'
-                             f'💪 Расширяйте свои знания!\n\n'
-                             f'⚡ <b>Уровень мастерства ждёт вас!</b>',
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    print(f"Ошибка отправки сообщения пользователю {user.tg_id}: {e}")
-        
-        await state.clear()
-        
-    except Exception as e:
-        await message.answer(f"❌ Ошибка при обработке файла: {str(e)}")
-        await state.clear()
-    finally:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+    
 
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
 
-def create_subjects_example():
+async def create_subjects_example():
     """Создаёт пример Excel файла для предметов"""
     df = pd.DataFrame({
         'Название': [
@@ -321,11 +344,11 @@ def create_subjects_example():
     })
     
     filename = 'example_subjects.xlsx'
-    df.to_excel(filename, index=False, header=False)
+    await write_excel(df, filename, index=False, header=False)
     return filename
 
 
-def create_themes_example():
+async def create_themes_example():
     """Создаёт пример Excel файла для тем"""
     df = pd.DataFrame({
         'Название': [
@@ -343,7 +366,7 @@ def create_themes_example():
     })
     
     filename = 'example_themes.xlsx'
-    df.to_excel(filename, index=False, header=False)
+    await write_excel(df, filename, index=False, header=False)
     return filename
 
 
@@ -7,7 +7,6 @@ from datetime import datetime
 
 import app.database.requests as rq
 import app.keyboards as kb
-import json
 
 
 client = Router()
@@ -133,17 +132,12 @@ async def my_statistics(message: Message):
         f'По предметам:\n'
     )
     
-    # Получаем все предметы и показываем баллы по каждому
-    subjects = await rq.get_subjects()
-    marks_by_subject = {}
-    if user.marks_by_subject:
-        marks_by_subject = json.loads(user.marks_by_subject)
-    
-    if subjects:
-        for subject in subjects:
-            subject_mark = int(marks_by_subject.get(str(subject.id), 0))
-            subject_tests = subject_mark // 10 if subject_mark > 0 else 0
-            stats += f'• {subject.name}: {subject_mark} баллов ({subject_tests} тестов)\n'
+    # Баллы по всем предметам одним запросом
+    scores = list(await rq.get_subject_scores(tg_id=message.from_user.id))
+    
+    if scores:
+        for subject_name, subject_mark, subject_tests in scores:
+            stats += f'• {subject_name}: {subject_mark} баллов ({subject_tests} тестов)\n'
     else:
         stats += '📚 Нет предметов в системе\n'
     
@@ -154,17 +148,10 @@ async def my_statistics(message: Message):
 async def weak_places(message: Message):
     now = datetime.now()
     print(f"User {message.from_user.first_name}({message.from_user.id}) send message at Дата: {now.strftime('%d.%m.%Y')}, Время: {now.strftime('%H:%M:%S')}: {message.text}")
-    user = await rq.get_user(tg_id=message.from_user.id)
-    
-    if not user.errors_by_theme:
-        await message.answer(
-            '✅ Отлично! У вас пока нет слабых мест.\n'
-            'Продолжайте решать тесты, чтобы система могла анализировать ваш прогресс.'
-        )
-        return
+    # Топ-5 тем по ошибкам вместе с названиями - один запрос
+    weak_themes = list(await rq.get_weak_themes(tg_id=message.from_user.id, limit=5))
     
-    errors = json.loads(user.errors_by_theme)
-    if not errors:
+    if not weak_themes:
         await message.answer(
             '✅ Отлично! У вас пока нет слабых мест.\n'
             'Продолжайте решать тесты, чтобы система могла анализировать ваш прогресс.'
@@ -172,14 +159,9 @@ async def weak_places(message: Message):
         return
     
     weak_text = '🎯 ВАШИ СЛАБЫЕ МЕСТА\n━━━━━━━━━━━━━━━━━━━━━━\n\n'
-    sorted_errors = sorted(errors.items(), key=lambda x: int(x[1]), reverse=True)
     
-    for theme_id_str, error_count in sorted_errors[:5]:
-        try:
-            theme = await rq.get_theme(int(theme_id_str))
-            weak_text += f'• {theme.name}: {error_count} ошибок\n'
-        except:
-            pass
+    for theme_id, theme_name, error_count in weak_themes:
+        weak_text += f'• {theme_name}: {error_count} ошибок\n'
     
     weak_text += '\n💡 Рекомендация: Повторите эти темы в разделе "Изучить темы"'
     await message.answer(weak_text)
@@ -297,30 +279,51 @@ async def start_test(callback: CallbackQuery, state: FSMContext):
     # Берём первые 10 вопросов (или все, если меньше)
     test_ids = [test.id for test in tests_list[:10]]
     
+    # В FSM храним только id вопросов, строку ответов и номер текущего вопроса
     await state.set_state(NavigationStates.test_in_progress)
     await state.update_data(
         test_ids=test_ids,
         current_question=0,
         subject_id=subject_id,
-        answers=[],
-        test_objects=tests_list[:10]
+        answers=''
     )
     
     # Показываем первый вопрос
     await show_question(callback, state)
 
 
-async def show_question(callback: CallbackQuery, state: FSMContext):
+async def next_question(state: FSMContext):
+    """Текущий вопрос теста: (номер, вопрос) или (номер, None), если вопросы закончились.
+    
+    Вопросы, удалённые во время теста, пропускаются; вместо ответа на них пишем '-',
+    чтобы строка ответов оставалась выровненной по test_ids.
+    """
     data = await state.get_data()
+    test_ids = data['test_ids']
     current_q = data['current_question']
-    test_objects = data['test_objects']
+    answers = data['answers']
+    tests = await rq.get_tests_by_ids(test_ids)
+    
+    while current_q < len(test_ids) and test_ids[current_q] not in tests:
+        current_q += 1
+        answers += '-'
+    if current_q != data['current_question']:
+        await state.update_data(current_question=current_q, answers=answers)
     
-    if current_q >= len(test_objects):
+    if current_q >= len(test_ids):
+        return current_q, None
+    return current_q, tests[test_ids[current_q]]
+
+
+async def show_question(callback: CallbackQuery, state: FSMContext):
+    first = (await state.get_data())['current_question'] == 0
+    current_q, test = await next_question(state)
+    
+    if test is None:
         # Тест закончился - показываем результаты
         await show_test_results(callback, state)
         return
     
-    test = test_objects[current_q]
     question_num = current_q + 1
     
     question_text = (
@@ -334,7 +337,7 @@ async def show_question(callback: CallbackQuery, state: FSMContext):
     )
     
     # Для первого вопроса используем answer, для остальных edit_text
-    if current_q == 0:
+    if first:
         await callback.message.answer(question_text, reply_markup=kb.answers)
     else:
         try:
@@ -347,15 +350,20 @@ async def show_question(callback: CallbackQuery, state: FSMContext):
 async def show_test_results(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     user = await rq.get_user(tg_id=callback.from_user.id)
-    test_objects = data['test_objects']
+    test_ids = data['test_ids']
     answers = data['answers']
     subject_id = data['subject_id']
+    tests = await rq.get_tests_by_ids(test_ids)
     
     # Подсчитываем правильные ответы и ошибки по темам
     correct_count = 0
     theme_errors = {}  # {theme_id: количество ошибок}
     
-    for i, (user_answer, test) in enumerate(zip(answers, test_objects)):
+    for user_answer, test_id in zip(answers, test_ids):
+        test = tests.get(test_id)
+        if test is None:
+            # Вопрос удалили, пока шёл тест
+            continue
         if user_answer == test.correct_answer:
             correct_count += 1
         else:
@@ -363,36 +371,11 @@ async def show_test_results(callback: CallbackQuery, state: FSMContext):
             theme_errors[theme_id] = theme_errors.get(theme_id, 0) + 1
     
     # Сохраняем ошибки в профиль пользователя
-    current_errors = {}
-    if user.errors_by_theme:
-        current_errors = json.loads(user.errors_by_theme)
+    await rq.add_theme_errors(user.tg_id, theme_errors)
     
-    for theme_id, count in theme_errors.items():
-        current_errors[str(theme_id)] = current_errors.get(str(theme_id), 0) + count
-    
-    await rq.update_user_errors(user.tg_id, json.dumps(current_errors))
-    
-    # Обновляем баллы для любого предмета
+    # Начисляем баллы по предмету и общий балл одним атомарным обновлением
     points_earned = correct_count * 10
-    
-    # Получаем текущие баллы по предметам из JSON
-    marks_by_subject = {}
-    if user.marks_by_subject:
-        marks_by_subject = json.loads(user.marks_by_subject)
-    
-    # Увеличиваем балл для текущего предмета
-    subject_id_str = str(subject_id)
-    marks_by_subject[subject_id_str] = marks_by_subject.get(subject_id_str, 0) + points_earned
-    
-    # Вычисляем общий балл
-    new_total_mark = sum(marks_by_subject.values())
-    
-    # Сохраняем баллы в БД
-    await rq.update_user(
-        tg_id=user.tg_id,
-        total_mark=new_total_mark,
-        marks_by_subject=json.dumps(marks_by_subject)
-    )
+    new_total_mark = await rq.add_subject_score(user.tg_id, subject_id, points_earned)
     
     # Формируем результат
     result_text = (
@@ -405,13 +388,14 @@ async def show_test_results(callback: CallbackQuery, state: FSMContext):
     
     if theme_errors:
         weak_themes = sorted(theme_errors.items(), key=lambda x: x[1], reverse=True)
+        # Все темы с ошибками одним запросом
+        themes_by_id = await rq.get_themes_by_ids(theme_errors.keys())
         result_text += f'\n❌ ОШИБКИ ПО ТЕМАМ:\n'
         
         for theme_id, error_count in weak_themes:
-            theme = await rq.get_theme(theme_id)
-            result_text += f'• {theme.name}: {error_count} ошибок\n'
+            result_text += f'• {themes_by_id[theme_id].name}: {error_count} ошибок\n'
         
-        result_text += f'\n💡 РЕКОМЕНДАЦИЯ: Повторите тему "{(await rq.get_theme(weak_themes[0][0])).name}"'
+        result_text += f'\n💡 РЕКОМЕНДАЦИЯ: Повторите тему "{themes_by_id[weak_themes[0][0]].name}"'
     elif correct_count == 10:
         result_text += '\n✅ Отлично! Все ответы правильные!'
     
@@ -422,7 +406,7 @@ async def show_test_results(callback: CallbackQuery, state: FSMContext):
         weak_theme_ids = [theme_id for theme_id, _ in weak_themes[:3]]  # Берём 3 слабейшие темы
         await callback.message.answer(
             '🎯 Хотите пройти тест для повторения слабых тем?',
-            reply_markup=await kb.get_weak_themes_kb(weak_theme_ids)
+            reply_markup=await kb.get_weak_themes_kb(weak_theme_ids, themes_by_id)
         )
     
     await state.clear()
@@ -470,12 +454,11 @@ async def process_answer(callback: CallbackQuery, state: FSMContext, answer: str
     else:
         return
     
-    test_objects = data['test_objects']
+    test_ids = data['test_ids']
     current_q = data['current_question']
-    answers = data['answers']
     
     # Сохраняем ответ
-    answers.append(answer)
+    answers = data['answers'] + answer
     current_q += 1
     
     await state.update_data(
@@ -484,7 +467,7 @@ async def process_answer(callback: CallbackQuery, state: FSMContext, answer: str
     )
     
     # Показываем следующий вопрос или результаты
-    if current_q < len(test_objects):
+    if current_q < len(test_ids):
         if is_weak_test:
             await show_weak_question(callback, state)
         else:
@@ -519,8 +502,7 @@ async def start_weak_theme_test(callback: CallbackQuery, state: FSMContext):
         test_ids=test_ids,
         current_question=0,
         theme_id=theme_id,
-        answers=[],
-        test_objects=tests_list[:10]
+        answers=''
     )
     
     await show_weak_question(callback, state)
@@ -601,15 +583,13 @@ async def finish_test(callback: CallbackQuery, state: FSMContext):
 
 
 async def show_weak_question(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    current_q = data['current_question']
-    test_objects = data['test_objects']
+    first = (await state.get_data())['current_question'] == 0
+    current_q, test = await next_question(state)
     
-    if current_q >= len(test_objects):
+    if test is None:
         await show_weak_test_results(callback, state)
         return
     
-    test = test_objects[current_q]
     question_num = current_q + 1
     
     question_text = (
@@ -623,7 +603,7 @@ async def show_weak_question(callback: CallbackQuery, state: FSMContext):
     )
     
     # Для первого вопроса используем answer, для остальных edit_text
-    if current_q == 0:
+    if first:
         await callback.message.answer(question_text, reply_markup=kb.answers)
     else:
         try:
@@ -636,13 +616,14 @@ async def show_weak_question(callback: CallbackQuery, state: FSMContext):
 async def show_weak_test_results(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     user = await rq.get_user(tg_id=callback.from_user.id)
-    test_objects = data['test_objects']
+    test_ids = data['test_ids']
     answers = data['answers']
     theme_id = data['theme_id']
+    tests = await rq.get_tests_by_ids(test_ids)
     
     # Подсчитываем правильные ответы
-    correct_count = sum(1 for user_answer, test in zip(answers, test_objects)
-                       if user_answer == test.correct_answer)
+    correct_count = sum(1 for user_answer, test_id in zip(answers, test_ids)
+                       if test_id in tests and user_answer == tests[test_id].correct_answer)
     
     points_earned = correct_count * 10
     theme = await rq.get_theme(theme_id)
@@ -0,0 +1,251 @@
+from collections import OrderedDict
+from collections.abc import KeysView
+from functools import wraps
+from types import MappingProxyType
+
+import asyncio
+import os
+import pickle
+
+try:
+    from redis import asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # Redis не обязателен: без него работает только кэш процесса
+    aioredis = None
+    RedisError = Exception
+
+# Ошибки (де)сериализации снимка: такой снимок просто не кэшируем в Redis и идём в БД
+SERIALIZATION_ERRORS = (pickle.PickleError, TypeError, AttributeError, ValueError, EOFError, ImportError)
+
+
+def dump_snapshot(value):
+    """Снимок каталога для Redis: MappingProxyType не сериализуется, поэтому храним его пары (id, строка)"""
+    if isinstance(value, MappingProxyType):
+        return pickle.dumps(('mapping', tuple(value.items())))
+    return pickle.dumps(('value', value))
+
+
+def load_snapshot(data):
+    kind, value = pickle.loads(data)
+    if kind == 'mapping':
+        return MappingProxyType(dict(value))
+    return value
+
+
+class CatalogCache:
+    """LRU-кэш каталога (предметы, темы, вопросы) с версией и ограничением по числу строк"""
+    def __init__(self, max_rows=50000):
+        self.max_rows = max_rows
+        self.version = 0
+        self._entries = OrderedDict()  # ключ -> (снимок, вес)
+        self._rows = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, version):
+        # Пока запрос шёл в БД, каталог мог измениться - такой снимок уже устарел
+        if version != self.version:
+            return
+        weight = len(value) if hasattr(value, '__len__') else 1
+        if weight > self.max_rows:
+            return
+        if key in self._entries:
+            self._rows -= self._entries.pop(key)[1]
+        self._entries[key] = (value, weight)
+        self._rows += weight
+        while self._rows > self.max_rows:
+            _, (_, evicted_weight) = self._entries.popitem(last=False)
+            self._rows -= evicted_weight
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+        self._rows = 0
+
+
+class SharedCache:
+    """Общий кэш в Redis для нескольких процессов бота: снимки каталога и профили пользователей"""
+    VERSION_KEY = 'catalog:version'
+    CHANNEL = 'catalog:invalidate'
+
+    def __init__(self, url, catalog_ttl=3600, profile_ttl=600):
+        self.redis = aioredis.from_url(url)
+        self.catalog_ttl = catalog_ttl
+        self.profile_ttl = profile_ttl
+        self.version = 0
+        self._listener = None
+
+    async def start(self):
+        self.version = int(await self.redis.get(self.VERSION_KEY) or 0)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+        await self.redis.close()
+
+    async def _listen(self):
+        """Сбрасывает кэш процесса, когда каталог изменили в любом процессе"""
+        while True:
+            try:
+                self.version = int(await self.redis.get(self.VERSION_KEY) or 0)
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(self.CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    self.version = int(message['data'])
+                    catalog_cache.invalidate()
+            except RedisError as e:
+                print(f"Потеряно соединение с Redis: {e}")
+                # Пока подписки не было, сообщения о сбросе могли потеряться
+                catalog_cache.invalidate()
+                await asyncio.sleep(1)
+
+    def _catalog_key(self, key, version):
+        return f'catalog:{version}:{key!r}'
+
+    async def get_catalog(self, key):
+        try:
+            data = await self.redis.get(self._catalog_key(key, self.version))
+        except RedisError as e:
+            print(f"Ошибка чтения кэша Redis: {e}")
+            return None
+        if not data:
+            return None
+        try:
+            return load_snapshot(data)
+        except SERIALIZATION_ERRORS as e:
+            print(f"Не удалось прочитать снимок из кэша Redis: {e}")
+            return None
+
+    async def put_catalog(self, key, value, version):
+        try:
+            data = dump_snapshot(value)
+        except SERIALIZATION_ERRORS as e:
+            print(f"Снимок не сохранён в кэш Redis: {e}")
+            return
+        # Ключ содержит версию: снимок, прочитанный до изменения каталога, никто уже не прочитает
+        try:
+            await self.redis.set(self._catalog_key(key, version), data, ex=self.catalog_ttl)
+        except RedisError as e:
+            print(f"Ошибка записи кэша Redis: {e}")
+
+    async def publish_invalidation(self):
+        try:
+            self.version = await self.redis.incr(self.VERSION_KEY)
+            await self.redis.publish(self.CHANNEL, self.version)
+        except RedisError as e:
+            print(f"Ошибка рассылки сброса кэша Redis: {e}")
+
+    async def get_profile(self, tg_id):
+        try:
+            data = await self.redis.get(f'profile:{tg_id}')
+        except RedisError as e:
+            print(f"Ошибка чтения кэша Redis: {e}")
+            return None
+        if not data:
+            return None
+        try:
+            return pickle.loads(data)
+        except SERIALIZATION_ERRORS as e:
+            print(f"Не удалось прочитать профиль из кэша Redis: {e}")
+            await self.delete_profile(tg_id)  # испорченная запись - профиль снова прочитаем из БД
+            return None
+
+    async def put_profile(self, tg_id, value):
+        try:
+            await self.redis.set(f'profile:{tg_id}', pickle.dumps(value), ex=self.profile_ttl)
+        except RedisError as e:
+            print(f"Ошибка записи кэша Redis: {e}")
+
+    async def delete_profile(self, tg_id):
+        try:
+            await self.redis.delete(f'profile:{tg_id}')
+        except RedisError as e:
+            print(f"Ошибка записи кэша Redis: {e}")
+
+
+catalog_cache = CatalogCache(max_rows=int(os.getenv('CATALOG_CACHE_ROWS', 50000)))
+shared_cache = None
+
+
+async def init_shared_cache(url=None):
+    """Подключает Redis-кэш, если задан REDIS_URL; иначе остаётся только кэш процесса"""
+    global shared_cache
+    url = url or os.getenv('REDIS_URL')
+    if not url or aioredis is None:
+        return None
+    shared_cache = SharedCache(url)
+    await shared_cache.start()
+    return shared_cache
+
+
+async def close_shared_cache():
+    global shared_cache
+    if shared_cache is not None:
+        await shared_cache.stop()
+        shared_cache = None
+
+
+async def invalidate_catalog():
+    """Сбрасывает кэш каталога в этом процессе и во всех остальных (через Redis)"""
+    catalog_cache.invalidate()
+    if shared_cache is not None:
+        await shared_cache.publish_invalidation()
+
+
+async def invalidate_profile(tg_id):
+    if shared_cache is not None:
+        await shared_cache.delete_profile(tg_id)
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set, frozenset, KeysView)):
+        return tuple(sorted(value, key=str))
+    return value
+
+
+def cached_catalog(func):
+    """Read-through кэш для запросов каталога: пока кэш тёплый, в БД не ходим"""
+    @wraps(func)
+    async def inner(*args, **kwargs):
+        key = (func.__name__, tuple(_freeze(a) for a in args), tuple(sorted((k, _freeze(v)) for k, v in kwargs.items())))
+        value = catalog_cache.get(key)
+        if value is not None:
+            return value
+        version = catalog_cache.version
+        if shared_cache is not None:
+            value = await shared_cache.get_catalog(key)
+            if value is not None:
+                catalog_cache.put(key, value, version)
+                return value
+            shared_version = shared_cache.version
+        value = await func(*args, **kwargs)
+        if value is not None:
+            catalog_cache.put(key, value, version)
+            if shared_cache is not None:
+                await shared_cache.put_catalog(key, value, shared_version)
+        return value
+    return inner
+
+
+def cached_profile(func):
+    """Кэш профиля пользователя в Redis (без Redis - всегда запрос в БД)"""
+    @wraps(func)
+    async def inner(tg_id):
+        if shared_cache is None:
+            return await func(tg_id)
+        value = await shared_cache.get_profile(tg_id)
+        if value is not None:
+            return value
+        value = await func(tg_id)
+        if value is not None:
+            await shared_cache.put_profile(tg_id, value)
+        return value
+    return inner
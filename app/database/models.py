@@ -1,10 +1,58 @@
-from sqlalchemy import ForeignKey, BigInteger, String
+from sqlalchemy import ForeignKey, BigInteger, String, Text, DateTime, Index, inspect, text, event, select, insert, update, func, bindparam
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
+from dotenv import load_dotenv
 
+import hashlib
+import json
+import os
 
-engine = create_async_engine(url='sqlite+aiosqlite:///yandex.db')
-async_session = async_sessionmaker(engine)
+
+load_dotenv()
+
+# Профили PRAGMA, применяемые к каждому новому соединению SQLite
+ENGINE_PROFILES = {
+    # Настройки SQLite по умолчанию (rollback-журнал, без busy_timeout)
+    'default': {},
+    # WAL: чтения не блокируют запись, ответы пишутся без "database is locked"
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': int(os.getenv('DB_CACHE_SIZE', -64000)),  # отрицательное значение - в КиБ
+        'temp_store': 'MEMORY',
+        'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT', 5000)),
+    },
+    # База в памяти для тестов: одно общее соединение на весь процесс
+    'memory': {
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def make_engine(profile=None, url=None):
+    """Создаёт движок с выбранным профилем (DB_PROFILE, по умолчанию production)"""
+    profile = profile or os.getenv('DB_PROFILE', 'production')
+    pragmas = ENGINE_PROFILES[profile]
+    
+    if profile == 'memory':
+        new_engine = create_async_engine(url='sqlite+aiosqlite:///:memory:', poolclass=StaticPool)
+    else:
+        new_engine = create_async_engine(url=url or os.getenv('DB_URL', 'sqlite+aiosqlite:///yandex.db'))
+    
+    @event.listens_for(new_engine.sync_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    
+    return new_engine
+
+
+engine = make_engine()
+async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
 class Base(DeclarativeBase, AsyncAttrs):
@@ -12,24 +60,31 @@ class Base(DeclarativeBase, AsyncAttrs):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_is_active_id', 'is_active', 'id'),
+        Index('ix_users_last_seen', 'last_seen'),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
-    tg_id = mapped_column(BigInteger)
+    tg_id = mapped_column(BigInteger, unique=True, index=True)
     name: Mapped[str] = mapped_column(String(25), nullable=True)
     total_mark: Mapped[int] = mapped_column(nullable=True, default=0)
     mark_for_chemistry: Mapped[int] = mapped_column(nullable=True, default=0)
     mark_for_math: Mapped[int] = mapped_column(nullable=True, default=0)
-    marks_by_subject: Mapped[str] = mapped_column(String(10000), nullable=True)  # JSON для баллов по всем предметам {subject_id: score}
+    marks_by_subject: Mapped[str] = mapped_column(String(10000), nullable=True)  # Устарело: баллы перенесены в user_subject_scores
     need_practice_subject: Mapped[str] = mapped_column(String(256), nullable=True)
     need_practice_theme: Mapped[str] = mapped_column(String(256), nullable=True)
-    errors_by_theme: Mapped[str] = mapped_column(String(10000), nullable=True)  # JSON для отслеживания ошибок
+    errors_by_theme: Mapped[str] = mapped_column(String(10000), nullable=True)  # Устарело: ошибки перенесены в user_theme_errors
+    is_active: Mapped[bool] = mapped_column(default=True, server_default=text('1'))  # False - бот заблокирован или чат удалён
+    inactive_since = mapped_column(DateTime, nullable=True)
+    last_seen = mapped_column(DateTime, nullable=True)  # последнее обращение к боту (обновляется не чаще раза в час)
     
     
 class Admin(Base):
     __tablename__ = 'admins'
     
     id: Mapped[int] = mapped_column(primary_key=True)
-    tg_id = mapped_column(BigInteger)
+    tg_id = mapped_column(BigInteger, unique=True, index=True)
     
 
 class Subject(Base):
@@ -43,7 +98,7 @@ class Theme(Base):
     __tablename__ = 'themes'
     
     id: Mapped[int] = mapped_column(primary_key=True)
-    subject_id: Mapped[int] = mapped_column(ForeignKey('subjects.id'))
+    subject_id: Mapped[int] = mapped_column(ForeignKey('subjects.id'), index=True)
     name: Mapped[str] = mapped_column(String(100), nullable=True)
     description: Mapped[str] = mapped_column(String(1000000), nullable=True)
     
@@ -52,8 +107,8 @@ class Test(Base):
     __tablename__ = 'tests'
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    theme_id: Mapped[int] = mapped_column(ForeignKey('themes.id'))
-    subject_id: Mapped[int] = mapped_column(ForeignKey('subjects.id'))
+    theme_id: Mapped[int] = mapped_column(ForeignKey('themes.id'), index=True)
+    subject_id: Mapped[int] = mapped_column(ForeignKey('subjects.id'), index=True)
     name: Mapped[str] = mapped_column(String(100), nullable=True)
     question: Mapped[str] = mapped_column(String(520), nullable=True)
     answer1: Mapped[str] = mapped_column(String(20), nullable=True)
@@ -62,8 +117,170 @@ class Test(Base):
     answer4: Mapped[str] = mapped_column(String(20), nullable=True)
     point: Mapped[int] = mapped_column(nullable=True)
     correct_answer: Mapped[str] = mapped_column(String(20), nullable=True)
+    content_hash: Mapped[str] = mapped_column(String(32), nullable=True)  # по полям TEST_CONTENT_FIELDS, для повторного импорта
+    
+
+# Всё содержимое вопроса, кроме ключа (theme_id, name)
+TEST_CONTENT_FIELDS = ('subject_id', 'question', 'answer1', 'answer2', 'answer3', 'answer4', 'point', 'correct_answer')
+
+
+def test_content_hash(test):
+    """Хэш содержимого вопроса (словарь или строка БД с полями TEST_CONTENT_FIELDS)"""
+    values = test if isinstance(test, dict) else test._mapping
+    content = '\x1f'.join(str(values[field]) for field in TEST_CONTENT_FIELDS)
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+class UserSubjectScore(Base):
+    __tablename__ = 'user_subject_scores'
+    __table_args__ = (
+        Index('ix_user_subject_scores_subject_id', 'subject_id'),
+    )
+    
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), primary_key=True)
+    subject_id: Mapped[int] = mapped_column(ForeignKey('subjects.id'), primary_key=True)
+    score: Mapped[int] = mapped_column(default=0)
+    tests_taken: Mapped[int] = mapped_column(default=0)
+    
+
+class UserThemeError(Base):
+    __tablename__ = 'user_theme_errors'
+    __table_args__ = (
+        Index('ix_user_theme_errors_user_id_errors', 'user_id', 'errors'),
+        Index('ix_user_theme_errors_theme_id_errors', 'theme_id', 'errors'),
+    )
+    
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), primary_key=True)
+    theme_id: Mapped[int] = mapped_column(ForeignKey('themes.id'), primary_key=True)
+    errors: Mapped[int] = mapped_column(default=0)
     
 
+class Job(Base):
+    """Фоновая задача (рассылка, импорт): переживает перезапуск бота"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_id', 'status', 'id'),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50))
+    payload: Mapped[str] = mapped_column(Text)  # JSON: входные данные задачи
+    state: Mapped[str] = mapped_column(Text, nullable=True)  # JSON: сколько уже сделано, чтобы продолжить после перезапуска
+    status: Mapped[str] = mapped_column(String(20), default='pending')  # pending, running, done, failed, cancelled
+    chat_id = mapped_column(BigInteger, nullable=True)  # кому сообщать о ходе задачи
+    done: Mapped[int] = mapped_column(default=0)
+    total: Mapped[int] = mapped_column(default=0)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    run_after = mapped_column(DateTime, nullable=True)  # отложенная задача (дайджест) не берётся раньше этого времени
+    created_at = mapped_column(DateTime, server_default=func.now())
+    updated_at = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+    
+
+class ContentEvent(Base):
+    """Новый контент, о котором ещё не рассказали в дайджесте"""
+    __tablename__ = 'content_events'
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20))  # subject, theme, question
+    name: Mapped[str] = mapped_column(String(100), nullable=True)
+    count: Mapped[int] = mapped_column(default=1)
+    subject_id: Mapped[int] = mapped_column(nullable=True)  # None - новость для всех пользователей
+    
+
+def migrate_columns(conn):
+    """Досоздаёт колонки, которых нет в уже существующей базе; возвращает добавленные"""
+    added = set()
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            default = f' DEFAULT {column.server_default.arg.text}' if column.server_default is not None else ''
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+            added.add((table.name, column.name))
+    return added
+
+
+def migrate_indexes(conn):
+    """Досоздаёт индексы, которых нет в уже существующей базе"""
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                # Дубликаты tg_id мешают построить уникальный индекс - оставляем самую раннюю запись
+                column = list(index.columns)[0].name
+                conn.execute(text(
+                    f'DELETE FROM {table.name} WHERE id NOT IN '
+                    f'(SELECT MIN(id) FROM {table.name} GROUP BY {column})'
+                ))
+            index.create(conn)
+
+
+def migrate_test_hashes(conn):
+    """Считает хэши содержимого для вопросов, добавленных до появления content_hash"""
+    columns = [Test.id] + [getattr(Test, field) for field in TEST_CONTENT_FIELDS]
+    rows = [
+        {'test_id': row.id, 'content_hash': test_content_hash(row)}
+        for row in conn.execute(select(*columns).where(Test.content_hash.is_(None)))
+    ]
+    if rows:
+        conn.execute(update(Test.__table__).where(Test.id == bindparam('test_id')), rows)
+
+
+def migrate_subject_scores(conn):
+    """Переносит баллы из JSON-поля users.marks_by_subject в user_subject_scores"""
+    subject_ids = set(conn.scalars(select(Subject.id)))
+    rows = []
+    for user_id, marks_json in conn.execute(select(User.id, User.marks_by_subject).where(User.marks_by_subject.is_not(None))):
+        try:
+            marks = json.loads(marks_json)
+        except ValueError:
+            continue
+        for subject_id, score in marks.items():
+            if int(subject_id) not in subject_ids:
+                continue
+            rows.append({
+                'user_id': user_id,
+                'subject_id': int(subject_id),
+                'score': int(score),
+                'tests_taken': int(score) // 10  # раньше число тестов оценивалось так же
+            })
+    if rows:
+        conn.execute(insert(UserSubjectScore), rows)
+
+
+def migrate_theme_errors(conn):
+    """Переносит ошибки из JSON-поля users.errors_by_theme в user_theme_errors"""
+    theme_ids = set(conn.scalars(select(Theme.id)))
+    rows = []
+    for user_id, errors_json in conn.execute(select(User.id, User.errors_by_theme).where(User.errors_by_theme.is_not(None))):
+        try:
+            errors = json.loads(errors_json)
+        except ValueError:
+            continue
+        for theme_id, count in errors.items():
+            if int(theme_id) not in theme_ids:
+                continue
+            rows.append({'user_id': user_id, 'theme_id': int(theme_id), 'errors': int(count)})
+    if rows:
+        conn.execute(insert(UserThemeError), rows)
+
+
 async def init_models():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        existing_tables = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names())
+        await conn.run_sync(Base.metadata.create_all)
+        added_columns = await conn.run_sync(migrate_columns)
+        if ('users', 'last_seen') in added_columns:
+            # Иначе все старые пользователи сразу попадут в сегмент "давно не заходили"
+            await conn.execute(text('UPDATE users SET last_seen = CURRENT_TIMESTAMP'))
+        if ('tests', 'content_hash') in added_columns:
+            await conn.run_sync(migrate_test_hashes)
+        await conn.run_sync(migrate_indexes)
+        if 'user_subject_scores' not in existing_tables:
+            await conn.run_sync(migrate_subject_scores)
+        if 'user_theme_errors' not in existing_tables:
+            await conn.run_sync(migrate_theme_errors)
\ No newline at end of file
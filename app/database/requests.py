@@ -1,10 +1,31 @@
+from contextvars import ContextVar
+from functools import wraps
+from types import MappingProxyType
+
 from app.database.models import async_session
-from app.database.models import User, Subject, Test, Theme, Admin
-from sqlalchemy import select, update, insert, delete
+from app.database.cache import cached_catalog, cached_profile, invalidate_catalog, invalidate_profile
+from app.database.models import User, Subject, Test, Theme, Admin, UserSubjectScore, UserThemeError, Job, ContentEvent, test_content_hash
+from sqlalchemy import select, update, insert, delete, func, or_, exists, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+import os
+
+
+# Сессия текущего апдейта (выставляется DbSessionMiddleware)
+current_session = ContextVar('current_session', default=None)
+
+# Размер пачки при потоковом обходе пользователей (рассылки)
+USERS_CHUNK_SIZE = int(os.getenv('USERS_CHUNK_SIZE', 1000))
 
 
 def connection(func):
+    """Передаёт в запрос сессию текущего апдейта или открывает новую (для скриптов)"""
+    @wraps(func)
     async def inner(*args, **kwargs):
+        session = current_session.get()
+        if session is not None:
+            return await func(session, *args, **kwargs)
         async with async_session() as session:
             return await func(session, *args, **kwargs)
     return inner
@@ -15,15 +36,39 @@ async def set_user(session, tg_id):
     user = await session.scalar(select(User).where(User.tg_id == tg_id))
     
     if not user:
-        session.add(User(tg_id=tg_id))
-        await session.commit()
+        session.add(User(tg_id=tg_id, last_seen=func.now()))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Параллельный /start уже создал пользователя (уникальный tg_id)
+            await session.rollback()
         return False
+    # Запоминаем визит; раз пользователь пишет боту, сообщения до него снова доходят
+    await session.execute(
+        update(User).where(User.id == user.id).values(last_seen=func.now(), is_active=True, inactive_since=None)
+    )
+    await session.commit()
+    if not user.is_active:
+        await invalidate_profile(tg_id)
     return True if user.name else False
 
 
+@connection
+async def touch_user(session, tg_id):
+    """Отмечает визит (любое обращение к боту); раз пользователь пишет боту, сообщения до него снова доходят"""
+    reactivated = await session.execute(
+        update(User).where(User.tg_id == tg_id, User.is_active == False).values(is_active=True, inactive_since=None)
+    )
+    await session.execute(update(User).where(User.tg_id == tg_id).values(last_seen=func.now()))
+    await session.commit()
+    if reactivated.rowcount:
+        await invalidate_profile(tg_id)
+
+
+@cached_profile
 @connection
 async def get_user(session, tg_id):
-    return await session.scalar(select(User).where(User.tg_id == tg_id))
+    return (await session.execute(select(User.__table__).where(User.tg_id == tg_id))).first()
 
 
 @connection
@@ -49,8 +94,95 @@ async def delete_admin(session, tg_id):
 
 
 @connection
-async def get_users(session):
-    return await session.scalars(select(User))
+async def get_users(session, active_only=False):
+    query = select(User)
+    if active_only:
+        query = query.where(User.is_active == True)
+    return await session.scalars(query)
+
+
+def segment_condition(segment):
+    """Условие на users для сегмента аудитории; каждый сегмент отбирается по своему индексу.
+
+    segment: {'subject_id': X} - проходили тесты по предмету X,
+    {'subject_ids': [X, ...]} - проходили тесты хотя бы по одному из предметов,
+    {'theme_id': Y, 'min_errors': N} - больше N ошибок в теме Y,
+    {'inactive_days': D} - не обращались к боту D дней (last_seen, см. LastSeenMiddleware).
+    """
+    if 'subject_id' in segment:
+        return User.id.in_(
+            select(UserSubjectScore.user_id)
+            .where(UserSubjectScore.subject_id == segment['subject_id'], UserSubjectScore.tests_taken > 0)
+        )
+    if 'subject_ids' in segment:
+        return User.id.in_(
+            select(UserSubjectScore.user_id)
+            .where(UserSubjectScore.subject_id.in_(segment['subject_ids']), UserSubjectScore.tests_taken > 0)
+        )
+    if 'theme_id' in segment:
+        return User.id.in_(
+            select(UserThemeError.user_id)
+            .where(UserThemeError.theme_id == segment['theme_id'], UserThemeError.errors > segment.get('min_errors', 0))
+        )
+    if 'inactive_days' in segment:
+        return User.last_seen < func.datetime('now', f"-{int(segment['inactive_days'])} days")
+    raise ValueError(f'Неизвестный сегмент: {segment}')
+
+
+def filter_users(query, active_only=False, segment=None):
+    if active_only:
+        query = query.where(User.is_active == True)
+    if segment:
+        query = query.where(segment_condition(segment))
+    return query
+
+
+@connection
+async def count_users(session, active_only=False, segment=None):
+    return await session.scalar(filter_users(select(func.count(User.id)), active_only, segment))
+
+
+@connection
+async def get_users_after(session, after_id, limit, active_only=False, segment=None):
+    """Следующая пачка пользователей после users.id = after_id (для продолжаемых рассылок)"""
+    query = filter_users(select(User.id, User.tg_id).where(User.id > after_id), active_only, segment)
+    return (await session.execute(query.order_by(User.id).limit(limit))).all()
+
+
+async def iter_user_chunks(chunk_size=USERS_CHUNK_SIZE, active_only=False, after_id=0, segment=None):
+    """Пачки (id, tg_id) по chunk_size: keyset-пагинация по users.id, на каждую пачку - свой короткий запрос"""
+    while True:
+        users = await get_users_after(after_id, chunk_size, active_only, segment)
+        if not users:
+            return
+        yield users
+        after_id = users[-1].id
+
+
+@connection
+async def get_studied_subjects(session, user_ids, subject_ids):
+    """Какие из subject_ids проходил каждый пользователь пачки: {users.id: {subject_id, ...}} одним запросом"""
+    rows = await session.execute(
+        select(UserSubjectScore.user_id, UserSubjectScore.subject_id)
+        .where(UserSubjectScore.user_id.in_(user_ids), UserSubjectScore.subject_id.in_(subject_ids),
+               UserSubjectScore.tests_taken > 0)
+    )
+    studied = {}
+    for user_id, subject_id in rows:
+        studied.setdefault(user_id, set()).add(subject_id)
+    return studied
+
+
+@connection
+async def deactivate_users(session, tg_ids):
+    """Помечает пользователей, заблокировавших бота или удаливших чат, - рассылки их пропускают"""
+    await session.execute(
+        update(User).where(User.tg_id.in_(tg_ids), User.is_active == True)
+        .values(is_active=False, inactive_since=func.now())
+    )
+    await session.commit()
+    for tg_id in tg_ids:
+        await invalidate_profile(tg_id)
 
 
 @connection
@@ -71,54 +203,154 @@ async def update_user(session, tg_id, name=None, total_mark=None, mark_for_chemi
     if update_data:
         await session.execute(update(User).where(User.tg_id == tg_id).values(**update_data))
         await session.commit()
+        await invalidate_profile(tg_id)
 
 
 @connection
-async def update_user_errors(session, tg_id, errors_json):
-    """Обновить информацию об ошибках пользователя"""
-    await session.execute(update(User).where(User.tg_id == tg_id).values(errors_by_theme=errors_json))
+async def add_subject_score(session, tg_id, subject_id, points):
+    """Атомарно начислить баллы за тест по предмету, вернуть новый общий балл"""
+    user_id = select(User.id).where(User.tg_id == tg_id).scalar_subquery()
+    result = await session.execute(
+        update(UserSubjectScore)
+        .where(UserSubjectScore.user_id == user_id, UserSubjectScore.subject_id == subject_id)
+        .values(score=UserSubjectScore.score + points, tests_taken=UserSubjectScore.tests_taken + 1)
+    )
+    if result.rowcount == 0:
+        await session.execute(insert(UserSubjectScore).values(
+            user_id=user_id,
+            subject_id=subject_id,
+            score=points,
+            tests_taken=1
+        ))
+    total_mark = await session.scalar(
+        update(User)
+        .where(User.tg_id == tg_id)
+        .values(total_mark=func.coalesce(User.total_mark, 0) + points, last_seen=func.now())
+        .returning(User.total_mark)
+    )
     await session.commit()
+    await invalidate_profile(tg_id)
+    return total_mark
+
+
+@connection
+async def get_subject_scores(session, tg_id):
+    """Баллы пользователя по всем предметам: (название, баллы, тестов)"""
+    user_id = select(User.id).where(User.tg_id == tg_id).scalar_subquery()
+    return await session.execute(
+        select(Subject.name, func.coalesce(UserSubjectScore.score, 0), func.coalesce(UserSubjectScore.tests_taken, 0))
+        .outerjoin(UserSubjectScore, (UserSubjectScore.subject_id == Subject.id) & (UserSubjectScore.user_id == user_id))
+        .order_by(Subject.id)
+    )
+
+
+@connection
+async def add_theme_errors(session, tg_id, theme_errors):
+    """Прибавить ошибки по темам ({theme_id: количество}) одним upsert-запросом"""
+    if not theme_errors:
+        return
+    user_id = select(User.id).where(User.tg_id == tg_id).scalar_subquery()
+    stmt = sqlite_insert(UserThemeError).values([
+        {'user_id': user_id, 'theme_id': theme_id, 'errors': count}
+        for theme_id, count in theme_errors.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserThemeError.user_id, UserThemeError.theme_id],
+        set_={'errors': UserThemeError.errors + stmt.excluded.errors}
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+@connection
+async def get_weak_themes(session, tg_id, limit=5):
+    """Темы с наибольшим числом ошибок: (id темы, название, ошибок)"""
+    user_id = select(User.id).where(User.tg_id == tg_id).scalar_subquery()
+    return await session.execute(
+        select(Theme.id, Theme.name, UserThemeError.errors)
+        .join(Theme, Theme.id == UserThemeError.theme_id)
+        .where(UserThemeError.user_id == user_id, UserThemeError.errors > 0)
+        .order_by(UserThemeError.errors.desc())
+        .limit(limit)
+    )
     
     
+@cached_catalog
 @connection
 async def get_subjects(session):
-    return await session.scalars(select(Subject))
+    return tuple(await session.execute(select(Subject.__table__)))
     
 
+@cached_catalog
 @connection
 async def get_themes(session):
-    return await session.scalars(select(Theme))
+    return tuple(await session.execute(select(Theme.__table__)))
 
 
+@cached_catalog
 @connection
 async def get_themes_by_subject(session, subject_id):
-    return await session.scalars(select(Theme).where(Theme.subject_id == subject_id))
+    return tuple(await session.execute(select(Theme.__table__).where(Theme.subject_id == subject_id)))
     
 
+@cached_catalog
 @connection
 async def get_theme(session, theme_id):
-    return await session.scalar(select(Theme).where(Theme.id == theme_id))
+    return (await session.execute(select(Theme.__table__).where(Theme.id == theme_id))).first()
+    
+
+@cached_catalog
+@connection
+async def get_themes_by_ids(session, theme_ids):
+    """Получить темы по списку id одним запросом: {theme_id: Theme}"""
+    theme_ids = set(theme_ids)
+    if not theme_ids:
+        return MappingProxyType({})
+    themes = await session.execute(select(Theme.__table__).where(Theme.id.in_(theme_ids)))
+    return MappingProxyType({theme.id: theme for theme in themes})
     
 
+@cached_catalog
 @connection
 async def get_test(session, test_id):
-    return await session.scalar(select(Test).where(Test.id == test_id))
+    return (await session.execute(select(Test.__table__).where(Test.id == test_id))).first()
 
 
+@cached_catalog
+@connection
+async def get_tests_by_ids(session, test_ids):
+    """Получить вопросы по списку id одним запросом: {test_id: Test}"""
+    test_ids = set(test_ids)
+    if not test_ids:
+        return MappingProxyType({})
+    tests = await session.execute(select(Test.__table__).where(Test.id.in_(test_ids)))
+    return MappingProxyType({test.id: test for test in tests})
+
+
+@cached_catalog
 @connection
 async def get_tests(session):
-    return await session.scalars(select(Test))
+    return tuple(await session.execute(select(Test.__table__)))
 
 
+@connection
+async def get_test_hashes(session):
+    """Для повторного импорта: {(theme_id, название): (id, хэш содержимого)} одним запросом"""
+    rows = await session.execute(select(Test.theme_id, Test.name, Test.id, Test.content_hash))
+    return {(theme_id, name): (test_id, content_hash) for theme_id, name, test_id, content_hash in rows}
+
+
+@cached_catalog
 @connection
 async def get_tests_by_theme_id(session, theme_id):
-    return await session.scalars(select(Test).where(Test.theme_id == theme_id))
+    return tuple(await session.execute(select(Test.__table__).where(Test.theme_id == theme_id)))
 
 
 @connection
 async def add_subject(session, name):
     session.add(Subject(name=name))
     await session.commit()
+    await invalidate_catalog()
     
 
 @connection
@@ -129,64 +361,219 @@ async def add_theme(session, subject_id, name, description):
         description=description
     ))
     await session.commit()
+    await invalidate_catalog()
     
     
 @connection
 async def add_test(session, theme_id, subject_id, name, question, answer1, answer2, answer3, answer4, point, correct_answer):
-    session.add(Test(
-        theme_id=theme_id,
-        subject_id=subject_id,
-        name=name,
-        question=question,
-        answer1=answer1,
-        answer2=answer2,
-        answer3=answer3,
-        answer4=answer4,
-        point=point,
-        correct_answer=correct_answer
-    ))
+    test = {
+        'theme_id': theme_id,
+        'subject_id': subject_id,
+        'name': name,
+        'question': question,
+        'answer1': answer1,
+        'answer2': answer2,
+        'answer3': answer3,
+        'answer4': answer4,
+        'point': point,
+        'correct_answer': correct_answer
+    }
+    session.add(Test(**test, content_hash=test_content_hash(test)))
     await session.commit()
+    await invalidate_catalog()
+
+
+async def insert_chunked(session, table, rows, chunk_size=None):
+    """executemany по chunk_size строк на транзакцию (по умолчанию - всё одной транзакцией)"""
+    if not rows:
+        return 0
+    chunk_size = chunk_size or len(rows)
+    for start in range(0, len(rows), chunk_size):
+        await session.execute(insert(table), rows[start:start + chunk_size])
+        await session.commit()
+    await invalidate_catalog()
+    return len(rows)
+
+
+@connection
+async def add_subjects_bulk(session, names, chunk_size=None):
+    return await insert_chunked(session, Subject.__table__, [{'name': name} for name in names], chunk_size)
+
+
+@connection
+async def add_themes_bulk(session, themes, chunk_size=None):
+    """themes - список словарей subject_id, name, description"""
+    return await insert_chunked(session, Theme.__table__, themes, chunk_size)
+
+
+@connection
+async def add_tests_bulk(session, tests, chunk_size=None):
+    """tests - список словарей с полями Test (theme_id, subject_id, name, question, answer1-4, point, correct_answer)"""
+    tests = [{**test, 'content_hash': test_content_hash(test)} for test in tests]
+    return await insert_chunked(session, Test.__table__, tests, chunk_size)
+
+
+@connection
+async def upsert_tests_bulk(session, new_tests, changed_tests):
+    """Одной транзакцией: добавляет new_tests и обновляет changed_tests (словари с id и полями Test)"""
+    if not new_tests and not changed_tests:
+        return
+    if new_tests:
+        await session.execute(insert(Test.__table__), [{**test, 'content_hash': test_content_hash(test)} for test in new_tests])
+    if changed_tests:
+        await session.execute(
+            update(Test.__table__).where(Test.id == bindparam('test_id')),
+            [{**{key: value for key, value in test.items() if key != 'id'}, 'test_id': test['id'], 'content_hash': test_content_hash(test)}
+             for test in changed_tests]
+        )
+    await session.commit()
+    await invalidate_catalog()
     
 
 @connection
 async def delete_subject(session, subject_id):
     await session.execute(delete(Subject).where(Subject.id == subject_id))
     await session.commit()
+    await invalidate_catalog()
 
 
 @connection
 async def delete_theme(session, theme_id):
     await session.execute(delete(Theme).where(Theme.id == theme_id))
     await session.commit()
+    await invalidate_catalog()
     
 
 @connection
 async def delete_test(session, test_id):
     await session.execute(delete(Test).where(Test.id == test_id))
     await session.commit()
+    await invalidate_catalog()
     
 
+@cached_catalog
 @connection
 async def get_subject(session, subject_id):
-    return await session.scalar(select(Subject).where(Subject.id == subject_id))
+    return (await session.execute(select(Subject.__table__).where(Subject.id == subject_id))).first()
 
 
+@cached_catalog
 @connection
 async def get_tests_by_subject(session, subject_id):
-    return await session.scalars(select(Test).where(Test.subject_id == subject_id))
+    return tuple(await session.execute(select(Test.__table__).where(Test.subject_id == subject_id)))
 
 
+@cached_catalog
 @connection
 async def get_tests_by_theme(session, theme_id):
-    return await session.scalars(select(Test).where(Test.theme_id == theme_id))
+    return tuple(await session.execute(select(Test.__table__).where(Test.theme_id == theme_id)))
 
 
+@cached_catalog
 @connection
 async def get_tests_by_themes(session, theme_ids):
     """Получить тесты по списку тем"""
-    return await session.scalars(select(Test).where(Test.theme_id.in_(theme_ids)))
+    return tuple(await session.execute(select(Test.__table__).where(Test.theme_id.in_(theme_ids))))
 
 
+@cached_catalog
 @connection
 async def get_all_tests(session):
-    return await session.scalars(select(Test))
\ No newline at end of file
+    return tuple(await session.execute(select(Test.__table__)))
+
+
+# ===== ФОНОВЫЕ ЗАДАЧИ =====
+
+@connection
+async def add_job(session, kind, payload, chat_id=None, delay=0):
+    run_after = func.datetime('now', f'+{int(delay)} seconds') if delay else None
+    job_id = await session.scalar(
+        insert(Job).values(kind=kind, payload=payload, chat_id=chat_id, run_after=run_after).returning(Job.id)
+    )
+    await session.commit()
+    return job_id
+
+
+@connection
+async def claim_job(session):
+    """Атомарно забирает самую старую ожидающую задачу"""
+    next_id = (
+        select(Job.id)
+        .where(Job.status == 'pending', or_(Job.run_after.is_(None), Job.run_after <= func.datetime('now')))
+        .order_by(Job.id).limit(1).scalar_subquery()
+    )
+    job = (await session.execute(
+        update(Job).where(Job.id == next_id, Job.status == 'pending')
+        .values(status='running').returning(Job.__table__)
+    )).first()
+    await session.commit()
+    return job
+
+
+@connection
+async def save_job_progress(session, job_id, done, total, state):
+    """Сохраняет прогресс задачи, возвращает её текущий статус (задачу могли отменить)"""
+    status = await session.scalar(
+        update(Job).where(Job.id == job_id)
+        .values(done=done, total=total, state=state).returning(Job.status)
+    )
+    await session.commit()
+    return status
+
+
+@connection
+async def finish_job(session, job_id, status, error=None):
+    await session.execute(
+        update(Job).where(Job.id == job_id, Job.status == 'running').values(status=status, error=error)
+    )
+    await session.commit()
+
+
+@connection
+async def cancel_job(session, job_id):
+    """Отменяет задачу, если она ещё не завершена; возвращает её данные до отмены"""
+    unfinished = Job.status.in_(('pending', 'running'))
+    job = (await session.execute(select(Job.__table__).where(Job.id == job_id, unfinished))).first()
+    if job is None:
+        return None
+    await session.execute(update(Job).where(Job.id == job_id, unfinished).values(status='cancelled'))
+    await session.commit()
+    return job
+
+
+@connection
+async def requeue_running_jobs(session):
+    """Задачи, прерванные остановкой бота, снова ставятся в очередь"""
+    result = await session.execute(update(Job).where(Job.status == 'running').values(status='pending'))
+    await session.commit()
+    return result.rowcount
+
+
+@connection
+async def has_pending_job(session, kind):
+    return await session.scalar(select(exists().where(Job.kind == kind, Job.status == 'pending')))
+
+
+@connection
+async def get_jobs(session, limit=10):
+    return (await session.execute(select(Job.__table__).order_by(Job.id.desc()).limit(limit))).all()
+
+
+# ===== ДАЙДЖЕСТ =====
+
+@connection
+async def add_content_event(session, kind, count=1, name=None, subject_id=None):
+    await session.execute(insert(ContentEvent).values(kind=kind, count=count, name=name, subject_id=subject_id))
+    await session.commit()
+
+
+@connection
+async def pop_content_events(session):
+    """Забирает накопленные события (они удаляются, чтобы не попасть в следующий дайджест)"""
+    events = (await session.execute(
+        delete(ContentEvent).returning(
+            ContentEvent.id, ContentEvent.kind, ContentEvent.name, ContentEvent.count, ContentEvent.subject_id
+        )
+    )).all()
+    await session.commit()
+    return sorted(events, key=lambda event: event.id)
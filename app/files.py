@@ -0,0 +1,411 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from openpyxl import Workbook, load_workbook
+
+import asyncio
+import functools
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import uuid
+
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow не обязателен: без него не принимаются только файлы Parquet
+    pq = None
+
+
+FILE_WORKERS = int(os.getenv('FILE_WORKERS', 2))  # потоков для чтения файлов и процессов для проверки пачек
+UPLOAD_MEMORY_LIMIT = int(os.getenv('UPLOAD_MEMORY_LIMIT', 20 * 1024 * 1024))  # байт: файлы больше сохраняются на диск
+
+_threads = ThreadPoolExecutor(max_workers=FILE_WORKERS, thread_name_prefix='files')
+_processes = None
+_sheet_process = None
+_uploads = {}  # загруженные файлы, которые держим в памяти до конца импорта
+_sheets = {}  # в процессе разбора Excel: открытые листы по ключу
+
+
+def _process_pool():
+    global _processes
+    if _processes is None:
+        # spawn: дочерние процессы не наследуют цикл событий и соединения с БД
+        _processes = ProcessPoolExecutor(max_workers=FILE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _processes
+
+
+def _sheet_pool():
+    """Один процесс для разбора Excel: открытый лист живёт в нём между запросами пачек"""
+    global _sheet_process
+    if _sheet_process is None:
+        _sheet_process = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    return _sheet_process
+
+
+async def run_in_process(func, *args, **kwargs):
+    """Тяжёлая работа на CPU (проверка пачек) в отдельном процессе - не держит ни GIL, ни цикл событий"""
+    return await asyncio.get_running_loop().run_in_executor(_process_pool(), functools.partial(func, *args, **kwargs))
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Короткие блокирующие операции с файлами в пуле потоков"""
+    return await asyncio.get_running_loop().run_in_executor(_threads, functools.partial(func, *args, **kwargs))
+
+
+def _temp_path(suffix):
+    fd, path = tempfile.mkstemp(prefix='upload_', suffix=suffix)
+    os.close(fd)
+    return path
+
+
+async def save_upload(bot, document):
+    """Скачивает присланный файл: небольшой - в память, больше UPLOAD_MEMORY_LIMIT - во временный файл.
+
+    Возвращает ссылку на файл для payload задачи: {'upload': ключ} или {'path': путь},
+    а также file_id, по которому файл можно скачать из Telegram заново.
+    """
+    if document.file_size is not None and document.file_size <= UPLOAD_MEMORY_LIMIT:
+        key = uuid.uuid4().hex
+        _uploads[key] = await bot.download(document)
+        return {'upload': key, 'file_id': document.file_id}
+    path = await run_in_thread(_temp_path, os.path.splitext(document.file_name or '')[1])
+    try:
+        await bot.download(document, destination=path)
+    except BaseException:
+        await remove_file(path)
+        raise
+    return {'path': path, 'file_id': document.file_id}
+
+
+async def upload_source(bot, payload):
+    """Файл задачи: буфер в памяти или путь на диске.
+
+    После перезапуска бота буфера в памяти нет (а временный файл могла удалить ОС) -
+    тогда файл скачивается из Telegram заново по file_id, и задача продолжается.
+    """
+    if 'upload' in payload:
+        if payload['upload'] not in _uploads:
+            if 'file_id' not in payload:  # задача поставлена до того, как file_id стал сохраняться
+                raise LookupError('файл хранился в памяти и потерян при перезапуске бота - загрузите его заново')
+            _uploads[payload['upload']] = await bot.download(payload['file_id'])
+        return _uploads[payload['upload']]
+    if 'file_id' in payload and not await run_in_thread(os.path.exists, payload['path']):
+        await bot.download(payload['file_id'], destination=payload['path'])
+    return payload['path']
+
+
+async def discard_upload(payload):
+    """Освобождает файл задачи, когда он больше не нужен"""
+    if not payload:
+        return
+    _uploads.pop(payload.get('upload'), None)
+    await remove_file(payload.get('path'))
+
+
+IMPORT_EXTENSIONS = ('.xlsx', '.csv', '.jsonl', '.json', '.parquet')
+
+
+class TableReader:
+    """Потоковое чтение таблицы без заголовка: в памяти только текущая пачка строк"""
+    def __init__(self, source):
+        self.source = source  # путь или файловый объект
+        self.total = None  # строк в файле, если формат позволяет узнать это заранее
+        self._width = 0
+
+    def _open(self, size, skip):
+        raise NotImplementedError
+
+    def _read(self):
+        """Следующая пачка строк (DataFrame или список кортежей); пустая - файл закончился"""
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    async def chunks(self, size, skip=0):
+        """Пачки по size строк: (строк файла прочитано, DataFrame с колонками 0, 1, ... как у read_excel без заголовка).
+
+        Индекс DataFrame - номер строки файла с нуля; полностью пустые строки отбрасываются.
+        """
+        if hasattr(self.source, 'seek'):
+            self.source.seek(0)
+        await run_in_thread(self._open, size, skip)
+        position = skip
+        try:
+            while True:
+                chunk = await run_in_thread(self._read)
+                if len(chunk) == 0:
+                    return
+                chunk = pd.DataFrame(chunk)
+                chunk.index = range(position, position + len(chunk))
+                chunk.columns = range(chunk.shape[1])
+                if chunk.shape[1] < self._width:
+                    chunk = chunk.reindex(columns=range(self._width))
+                position += len(chunk)
+                yield position, chunk.dropna(how='all')
+        finally:
+            await run_in_thread(self._close)
+
+
+def _sheet_open(key, source, size, skip):
+    workbook = load_workbook(io.BytesIO(source) if isinstance(source, bytes) else source, read_only=True, data_only=True)
+    sheet = workbook.active
+    rows = sheet.iter_rows(values_only=True)
+    for _ in islice(rows, skip):
+        pass
+    _sheets[key] = (workbook, rows, size)
+    return sheet.max_row, sheet.max_column or 0  # по разметке листа (у некоторых файлов её нет)
+
+
+def _sheet_read(key):
+    _, rows, size = _sheets[key]
+    return list(islice(rows, size))
+
+
+def _sheet_close(key):
+    if key in _sheets:
+        _sheets.pop(key)[0].close()
+
+
+class SheetReader(TableReader):
+    """Первый лист Excel через openpyxl read_only.
+
+    Разбор XML держит GIL, поэтому идёт в отдельном процессе, а не в пуле потоков;
+    следующая пачка разбирается, пока обрабатывается текущая.
+    """
+    def _open(self, size, skip):
+        self._key = uuid.uuid4().hex
+        source = self.source.getvalue() if hasattr(self.source, 'getvalue') else self.source
+        self.total, self._width = _sheet_pool().submit(_sheet_open, self._key, source, size, skip).result()
+        self._next = _sheet_pool().submit(_sheet_read, self._key)
+
+    def _read(self):
+        rows = self._next.result()
+        if rows:
+            self._next = _sheet_pool().submit(_sheet_read, self._key)
+        return rows
+
+    def _close(self):
+        _sheet_pool().submit(_sheet_close, self._key).result()
+
+
+class CsvReader(TableReader):
+    """CSV через pandas (C-парсер) пачками по chunksize.
+
+    Все ячейки читаются строками, как текстовые ячейки Excel: иначе pandas угадывает типы в каждой
+    пачке отдельно ('007' превращается в 7, а число рядом с пустой ячейкой - в 1.0).
+    Числовые колонки приводит к числам проверка (validate_questions).
+    """
+    def _open(self, size, skip):
+        self._chunks = pd.read_csv(self.source, header=None, chunksize=size, skiprows=skip, dtype=str,
+                                   keep_default_na=False, na_values=[''], encoding='utf-8-sig', skip_blank_lines=False)
+
+    def _read(self):
+        return next(self._chunks, [])
+
+    def _close(self):
+        self._chunks.close()
+
+
+def json_row(value):
+    """Строка таблицы из JSON: массив значений по колонкам, объект (значения по порядку ключей) или одно значение"""
+    if isinstance(value, dict):
+        return list(value.values())
+    return value if isinstance(value, list) else [value]
+
+
+class JsonLinesReader(TableReader):
+    """JSON Lines: в строке - массив значений по колонкам или объект (значения берутся по порядку ключей)"""
+    def _open(self, size, skip):
+        self._size = size
+        if hasattr(self.source, 'read'):
+            self._stream = io.TextIOWrapper(self.source, encoding='utf-8-sig')
+        else:
+            self._stream = open(self.source, encoding='utf-8-sig')
+        for _ in islice(self._stream, skip):
+            pass
+
+    def _read(self):
+        return [json_row(json.loads(line) if line.strip() else []) for line in islice(self._stream, self._size)]
+
+    def _close(self):
+        if hasattr(self.source, 'read'):
+            self._stream.detach()  # буфер загрузки остаётся открытым
+        else:
+            self._stream.close()
+
+
+class JsonReader(TableReader):
+    """Обычный JSON: весь файл - массив строк; документ разбирается целиком, а отдаётся пачками"""
+    def _open(self, size, skip):
+        self._size = size
+        if hasattr(self.source, 'read'):
+            rows = json.load(self.source)
+        else:
+            with open(self.source, 'rb') as file:
+                rows = json.load(file)
+        if not isinstance(rows, list):
+            raise ValueError('JSON-файл должен содержать массив строк')
+        self.total = len(rows)
+        self._rows = iter(rows)
+        for _ in islice(self._rows, skip):
+            pass
+
+    def _read(self):
+        return [json_row(value) for value in islice(self._rows, self._size)]
+
+
+class ParquetReader(TableReader):
+    """Parquet через pyarrow пачками по batch_size"""
+    def _open(self, size, skip):
+        if pq is None:
+            raise RuntimeError('для импорта Parquet установите pyarrow')
+        self._file = pq.ParquetFile(self.source)
+        self.total = self._file.metadata.num_rows
+        self._batches = self._file.iter_batches(batch_size=size)
+        self._first = None
+        while skip > 0:
+            batch = next(self._batches, None)
+            if batch is None:
+                break
+            if batch.num_rows > skip:
+                self._first = batch.slice(skip)
+            skip -= batch.num_rows
+
+    def _read(self):
+        batch, self._first = self._first, None
+        if batch is None:
+            batch = next(self._batches, None)
+        return batch.to_pandas() if batch is not None else []
+
+    def _close(self):
+        self._file.close()
+
+
+READERS = {'xlsx': SheetReader, 'csv': CsvReader, 'jsonl': JsonLinesReader, 'json': JsonReader, 'parquet': ParquetReader}
+
+
+def json_layout(first_line):
+    """jsonl, если первая строка файла - отдельная запись таблицы; иначе json (весь файл - один массив)"""
+    try:
+        value = json.loads(first_line)
+    except ValueError:
+        return 'json'  # массив, записанный на нескольких строках
+    if isinstance(value, list) and any(isinstance(item, (list, dict)) for item in value):
+        return 'json'  # массив строк, записанный в одну строку
+    return 'jsonl'
+
+
+def detect_format(source):
+    """Формат файла по первым байтам: xlsx (zip), parquet, json, jsonl или csv"""
+    if hasattr(source, 'read'):
+        source.seek(0)
+        head = source.read(64)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as file:
+            head = file.read(64)
+    if head.startswith(b'PK\x03\x04'):
+        return 'xlsx'
+    if head.startswith(b'PAR1'):
+        return 'parquet'
+    if head.lstrip(b'\xef\xbb\xbf \t\r\n')[:1] in (b'{', b'['):
+        if hasattr(source, 'read'):
+            first_line = source.readline()
+            source.seek(0)
+        else:
+            with open(source, 'rb') as file:
+                first_line = file.readline()
+        return json_layout(first_line)
+    return 'csv'
+
+
+async def open_table(source):
+    """Потоковый читатель для файла любого поддерживаемого формата"""
+    return READERS[await run_in_thread(detect_format, source)](source)
+
+
+async def map_chunks(reader, size, func, *args, skip=0):
+    """Читает файл пачками и считает func(пачка, *args) для каждой; отдаёт (позиция, пачка, результат) по порядку.
+
+    Первая пачка обрабатывается сразу (небольшому файлу пул процессов не нужен),
+    следующие - в пуле процессов, до FILE_WORKERS пачек одновременно.
+    """
+    pending = deque()
+    first = True
+    try:
+        async for position, chunk in reader.chunks(size, skip=skip):
+            if first:
+                first = False
+                yield position, chunk, func(chunk, *args)
+                continue
+            pending.append((position, chunk, asyncio.ensure_future(run_in_process(func, chunk, *args))))
+            if len(pending) >= FILE_WORKERS:
+                position, chunk, future = pending.popleft()
+                yield position, chunk, await future
+        while pending:
+            position, chunk, future = pending.popleft()
+            yield position, chunk, await future
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+
+class ReportWorkbook:
+    """Отчёт в Excel, строки которого дописываются по мере готовности (openpyxl write_only)"""
+    def __init__(self, title, header):
+        self.title = title
+        self.header = header
+        self.rows = 0
+        self._workbook = None  # создаётся с первой строкой: пустой отчёт не держит временных файлов
+
+    def _sheet(self):
+        if self._workbook is None:
+            self._workbook = Workbook(write_only=True)
+            self._workbook.create_sheet(self.title).append(self.header)
+        return self._workbook.worksheets[0]
+
+    def _append(self, rows):
+        sheet = self._sheet()
+        for row in rows:
+            sheet.append(row)
+        self.rows += len(rows)
+
+    async def append(self, rows):
+        if rows:
+            await run_in_thread(self._append, rows)
+
+    async def save(self):
+        """Содержимое файла .xlsx в байтах"""
+        buffer = io.BytesIO()
+        self._sheet()
+        await run_in_thread(self._workbook.save, buffer)
+        return buffer.getvalue()
+
+
+async def write_excel(df, path, **kwargs):
+    await run_in_thread(df.to_excel, path, **kwargs)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def remove_file(path):
+    """Удаляет файл, если он есть"""
+    if path:
+        await run_in_thread(_remove, path)
+
+
+def shutdown_files():
+    global _processes, _sheet_process
+    _threads.shutdown(wait=False, cancel_futures=True)
+    for pool in (_processes, _sheet_process):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _processes = _sheet_process = None
@@ -0,0 +1,166 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+import app.database.requests as rq
+from app.files import discard_upload
+
+import asyncio
+import json
+import os
+import time
+
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+POLL_INTERVAL = 5  # сек. между проверками очереди, если никто не разбудил воркеров
+PROGRESS_INTERVAL = 3  # сек. между обновлениями сообщения с прогрессом
+PROGRESS_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', 1000))  # строк файла на одну транзакцию импорта и сохранение прогресса
+
+STATUS_TITLES = {
+    'pending': '🕓 в очереди',
+    'running': '⏳ выполняется',
+    'done': '✅ завершена',
+    'failed': '❌ ошибка',
+    'cancelled': '🚫 отменена',
+}
+
+_handlers = {}
+_titles = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(kind, title):
+    """Регистрирует обработчик задач типа kind"""
+    def decorator(func):
+        _handlers[kind] = func
+        _titles[kind] = title
+        return func
+    return decorator
+
+
+def job_title(kind):
+    return _titles.get(kind, kind)
+
+
+class Job:
+    """Задача в работе: входные данные, сохраняемое состояние и прогресс"""
+    def __init__(self, row, bot: Bot):
+        self.id = row.id
+        self.kind = row.kind
+        self.payload = json.loads(row.payload)
+        self.state = json.loads(row.state) if row.state else {}
+        self.chat_id = row.chat_id
+        self.done = row.done
+        self.total = row.total
+        self.bot = bot
+        self._reported = 0.0
+
+    async def progress(self, done, total=None):
+        """Сохраняет прогресс и состояние; прерывает задачу, если её отменили"""
+        self.done = done
+        if total is not None:
+            self.total = total
+        status = await rq.save_job_progress(self.id, self.done, self.total, json.dumps(self.state))
+        if status == 'cancelled':
+            raise JobCancelled()
+        await self._report()
+
+    async def _report(self):
+        message_id = self.payload.get('message_id')
+        if not message_id or time.monotonic() - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = time.monotonic()
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=message_id,
+                text=f"⏳ {job_title(self.kind)} (задача #{self.id}): {self.done} из {self.total}"
+            )
+        except TelegramAPIError:
+            pass  # сообщение могли удалить - прогресс всё равно виден в списке задач
+
+
+class JobQueue:
+    """Очередь фоновых задач в таблице jobs: хендлеры только ставят задачу и сразу отвечают"""
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self.bot = None
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    async def start(self, bot: Bot):
+        self.bot = bot
+        resumed = await rq.requeue_running_jobs()
+        if resumed:
+            print(f'Возобновлено фоновых задач: {resumed}')
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Прерванные задачи остаются в статусе running и продолжатся после перезапуска
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, kind, payload, chat_id=None, delay=0):
+        """Ставит задачу в очередь; с delay - не раньше чем через delay секунд"""
+        job_id = await rq.add_job(kind, json.dumps(payload, ensure_ascii=False), chat_id, delay)
+        self._wakeup.set()
+        return job_id
+
+    async def cancel(self, job_id):
+        job = await rq.cancel_job(job_id)
+        if job is not None and job.status == 'pending':
+            # Задачу ещё не начинали - её файл больше никому не нужен
+            await discard_upload(json.loads(job.payload))
+        return job
+
+    async def _worker(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                row = await rq.claim_job()
+                if row is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(Job(row, self.bot))
+            except Exception as e:
+                # Например, "database is locked" во время долгой транзакции импорта: воркер не должен умирать
+                print(f'Ошибка воркера очереди задач: {e}')
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _run(self, job: Job):
+        handler = _handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f'неизвестный тип задачи {job.kind}')
+            await handler(job)
+        except JobCancelled:
+            print(f'Задача #{job.id} ({job.kind}) отменена')
+        except Exception as e:
+            print(f'Ошибка в задаче #{job.id} ({job.kind}): {e}')
+            await self._finish(job, 'failed', str(e))
+            if job.chat_id:
+                try:
+                    await self.bot.send_message(chat_id=job.chat_id, text=f"❌ {job_title(job.kind)} (задача #{job.id}) завершилась ошибкой: {e}")
+                except TelegramAPIError:
+                    pass
+        else:
+            await self._finish(job, 'done')
+        # При остановке бота (CancelledError) файл остаётся - задача продолжится после перезапуска
+        await discard_upload(job.payload)
+
+    async def _finish(self, job: Job, status, error=None):
+        try:
+            await rq.finish_job(job.id, status, error)
+        except Exception as e:
+            # Задача останется в статусе running и продолжится с сохранённого состояния после перезапуска
+            print(f'Не удалось сохранить статус задачи #{job.id}: {e}')
+
+
+job_queue = JobQueue()
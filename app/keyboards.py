@@ -32,14 +32,26 @@ admin_kb = ReplyKeyboardMarkup(keyboard=[
     [KeyboardButton(text='📁 Импорт тем')],  # НОВАЯ КНОПКА
     [KeyboardButton(text='❓ Добавить вопрос'),
      KeyboardButton(text='🗑️ Удалить вопрос')],
-    [KeyboardButton(text='📁 Импорт вопросов')],  # НОВАЯ КНОПКА
+    [KeyboardButton(text='📁 Импорт вопросов'),
+     KeyboardButton(text='🔄 Обновить вопросы'),
+     KeyboardButton(text='🔍 Проверить вопросы')],
     [KeyboardButton(text='👤 Добавить администратора'),
-     KeyboardButton(text='❌ Удалить администратора')]
+     KeyboardButton(text='❌ Удалить администратора')],
+    [KeyboardButton(text='📢 Рассылка'),
+     KeyboardButton(text='⏳ Фоновые задачи')]
 ],
                                resize_keyboard=True
                                )
 
 
+segments_kb = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text='👥 Все пользователи', callback_data='segment_all')],
+    [InlineKeyboardButton(text='📚 Занимаются предметом', callback_data='segment_subject')],
+    [InlineKeyboardButton(text='🎯 Много ошибок в теме', callback_data='segment_theme')],
+    [InlineKeyboardButton(text='💤 Давно не заходили', callback_data='segment_inactive')]
+])
+
+
 main_menu_kb = ReplyKeyboardMarkup(keyboard=[
     [KeyboardButton(text='📚 Выбрать предмет'), KeyboardButton(text='📖 Изучить темы')],
     [KeyboardButton(text='✏️ Сдать тест'), KeyboardButton(text='📊 Моя статистика')],
@@ -150,11 +162,13 @@ async def get_theme_back_kb():
     return keyboard.adjust(1).as_markup()
 
 
-async def get_weak_themes_kb(theme_ids):
-    """Клавиатура для рекомендационных тестов по слабым темам"""
+async def get_weak_themes_kb(theme_ids, themes=None):
+    """Клавиатура для рекомендационных тестов по слабым темам (themes - уже загруженные {id: Theme})"""
     keyboard = InlineKeyboardBuilder()
+    if themes is None:
+        themes = await rq.get_themes_by_ids(theme_ids)
     for theme_id in theme_ids:
-        theme = await rq.get_theme(theme_id)
+        theme = themes[theme_id]
         keyboard.add(InlineKeyboardButton(text=theme.name, callback_data=f'weak_theme_{theme_id}'))
     keyboard.add(InlineKeyboardButton(text='← Назад в меню', callback_data='back_to_menu'))
     return keyboard.adjust(1).as_markup()
@@ -193,4 +207,13 @@ async def get_themes():
     themes = await rq.get_themes()
     for theme in themes:
         keyboard.add(InlineKeyboardButton(text=theme.name, callback_data=f'empty_data'))
-    return keyboard.adjust(2).as_markup()
\ No newline at end of file
+    return keyboard.adjust(2).as_markup()
+
+
+def jobs_kb(jobs):
+    keyboard = InlineKeyboardBuilder()
+    for job in jobs:
+        if job.status in ('pending', 'running'):
+            keyboard.add(InlineKeyboardButton(text=f'🚫 Отменить задачу #{job.id}', callback_data=f'cancel_job_{job.id}'))
+    keyboard.add(InlineKeyboardButton(text='🔄 Обновить', callback_data='refresh_jobs'))
+    return keyboard.adjust(1).as_markup()
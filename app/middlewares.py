@@ -0,0 +1,69 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.database.requests as rq
+from app.database.requests import current_session
+
+import time
+
+
+LAST_SEEN_INTERVAL = 3600  # сек.: last_seen пишется в БД не чаще раза в час на пользователя
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия БД на весь апдейт: передаётся в хендлеры и во все rq.* запросы"""
+    def __init__(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.session_pool() as session:
+            data['session'] = session
+            token = current_session.set(session)
+            try:
+                return await handler(event, data)
+            finally:
+                current_session.reset(token)
+
+
+class LastSeenMiddleware(BaseMiddleware):
+    """Отмечает визит при любом апдейте пользователя (кнопки, темы, статистика), а не только /start и тесты.
+
+    Регистрируется после DbSessionMiddleware: запись идёт в сессию апдейта до вызова хендлера.
+    """
+    def __init__(self, interval=LAST_SEEN_INTERVAL, max_users=100000):
+        self.interval = interval
+        self.max_users = max_users
+        self._touched = {}  # tg_id -> когда last_seen последний раз записан этим процессом
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is not None and not user.is_bot:
+            now = time.monotonic()
+            touched = self._touched.get(user.id)
+            if touched is None or now - touched >= self.interval:
+                self._touched[user.id] = now
+                try:
+                    await rq.touch_user(user.id)
+                except SQLAlchemyError as e:
+                    print(f"Не удалось отметить визит пользователя {user.id}: {e}")
+                    session = current_session.get()
+                    if session is not None:
+                        await session.rollback()  # сессия апдейта нужна хендлеру
+                if len(self._touched) > self.max_users:
+                    border = now - self.interval
+                    self._touched = {tg_id: at for tg_id, at in self._touched.items() if at > border}
+        return await handler(event, data)
@@ -0,0 +1,125 @@
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import aiosqlite
+import asyncio
+import json
+import os
+import time
+
+
+def pack_data(data):
+    """Компактный JSON без пробелов: формат не зависит от версии Python"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def unpack_data(raw):
+    try:
+        return json.loads(raw)
+    except ValueError:
+        # Запись в прежнем формате (marshal) или повреждена - считаем сессию брошенной
+        return {}
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM в отдельном файле SQLite: переживает перезапуск, брошенные сессии удаляются по TTL"""
+    def __init__(self, path='fsm.db', ttl=86400, cleanup_interval=600):
+        self.path = path
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = DefaultKeyBuilder()
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._last_cleanup = 0.0
+
+    async def _connect(self):
+        async with self._lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self.path)
+                await db.execute('PRAGMA journal_mode=WAL')
+                await db.execute('PRAGMA synchronous=NORMAL')
+                await db.execute(
+                    'CREATE TABLE IF NOT EXISTS fsm ('
+                    'key TEXT PRIMARY KEY, state TEXT, data BLOB, updated_at REAL NOT NULL)'
+                )
+                await db.execute('CREATE INDEX IF NOT EXISTS ix_fsm_updated_at ON fsm (updated_at)')
+                await db.commit()
+                self._db = db
+        return self._db
+
+    async def _write(self, key: StorageKey, column: str, value) -> None:
+        db = await self._connect()
+        now = time.time()
+        storage_key = self.key_builder.build(key)
+        other = 'data' if column == 'state' else 'state'
+        # Вторая половина просроченной записи не должна "ожить" вместе с новой
+        await db.execute(
+            f'INSERT INTO fsm (key, {column}, updated_at) VALUES (?, ?, ?) '
+            f'ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, '
+            f'{other} = CASE WHEN fsm.updated_at < ? THEN NULL ELSE fsm.{other} END, '
+            f'updated_at = excluded.updated_at',
+            (storage_key, value, now, now - self.ttl)
+        )
+        # Пустые записи (нет ни состояния, ни данных) не храним
+        await db.execute('DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL', (storage_key,))
+        if now - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = now
+            await db.execute('DELETE FROM fsm WHERE updated_at < ?', (now - self.ttl,))
+        await db.commit()
+
+    async def _read(self, key: StorageKey, column: str):
+        db = await self._connect()
+        async with db.execute(
+            f'SELECT {column} FROM fsm WHERE key = ? AND updated_at >= ?',
+            (self.key_builder.build(key), time.time() - self.ttl)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._read(key, 'state')
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        await self._write(key, 'data', pack_data(data) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        raw = await self._read(key, 'data')
+        return unpack_data(raw) if raw else {}
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def make_redis_storage(url, ttl):
+    """RedisStorage с компактным JSON; redis импортируется только здесь - без него работают остальные хранилища"""
+    from aiogram.fsm.storage.redis import RedisStorage
+
+    class CompactRedisStorage(RedisStorage):
+        async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+            raw = await self.redis.get(self.key_builder.build(key, 'data'))
+            return unpack_data(raw) if raw else {}
+
+    return CompactRedisStorage.from_url(url, state_ttl=ttl, data_ttl=ttl, json_dumps=pack_data)
+
+
+def make_storage():
+    """Хранилище FSM по FSM_STORAGE: sqlite (по умолчанию), redis или memory"""
+    kind = os.getenv('FSM_STORAGE', 'sqlite')
+    ttl = int(os.getenv('FSM_TTL', 86400))  # сессия, к которой не возвращались сутки, считается брошенной
+
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'redis':
+        return make_redis_storage(os.getenv('REDIS_URL'), ttl)
+    return SQLiteStorage(path=os.getenv('FSM_DB_PATH', 'fsm.db'), ttl=ttl)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+
+QUESTION_COLUMNS = 9
+CORRECT_ANSWERS = ['А', 'Б', 'В', 'Г']
+DEFAULT_POINTS = 10
+ERROR_MESSAGES = [
+    'ошибка обработки - ID предмета, ID темы и баллы должны быть числами',
+    'пропущены обязательные поля',
+    'предмет с ID {subject_id} не найден',
+    'тема с ID {theme_id} не найдена',
+    'тема {theme_id} не принадлежит предмету {subject_id}',
+    'должно быть ровно 4 варианта ответа (через |)',
+    'правильный ответ должен быть А, Б, В или Г',
+]
+TEST_COLUMNS = ['theme_id', 'subject_id', 'name', 'question', 'answer1', 'answer2', 'answer3', 'answer4', 'point', 'correct_answer']
+
+
+def text_column(column):
+    """Строка без пробелов по краям; пустая ячейка - пустая строка"""
+    return column.astype(str).str.strip().where(column.notna(), '')
+
+
+def validate_questions(df, subject_ids, theme_subjects):
+    """Проверяет лист с вопросами целиком по колонкам (без обхода строк).
+
+    subject_ids - id существующих предметов, theme_subjects - {id темы: id её предмета}.
+    Аргументы - простые типы, поэтому проверку можно отдать в пул процессов.
+    Возвращает (вопросы, прошедшие проверку, в формате таблицы tests; отчёт об ошибках с колонками row, error).
+    Индекс обеих таблиц - номер строки листа (с нуля).
+    """
+    if df.shape[1] < QUESTION_COLUMNS:
+        errors = pd.DataFrame({'row': df.index + 1, 'error': f'недостаточно колонок (нужно {QUESTION_COLUMNS})'}, index=df.index)
+        return pd.DataFrame(columns=TEST_COLUMNS), errors
+
+    # Приводим типы: числа - через to_numeric, всё остальное - к строкам
+    subject_id = pd.to_numeric(df[0], errors='coerce')
+    theme_id = pd.to_numeric(df[2], errors='coerce')
+    points = pd.to_numeric(df[8], errors='coerce')
+    name = text_column(df[4])
+    question = text_column(df[5])
+    answers_raw = text_column(df[6])
+    correct_answer = text_column(df[7]).str.upper()
+
+    bad_numbers = (
+        (df[0].notna() & subject_id.isna())
+        | (df[2].notna() & theme_id.isna())
+        | (df[8].notna() & points.isna())
+    )
+    subject_id = subject_id.fillna(0).astype('int64')
+    theme_id = theme_id.fillna(0).astype('int64')
+    points = points.fillna(DEFAULT_POINTS).astype('int64')
+
+    # Тема -> предмет по справочнику тем
+    theme_subject = theme_id.map(pd.Series(theme_subjects, dtype='float64'))
+
+    # Проверки в том же порядке, что и раньше: строке достаётся первая найденная ошибка
+    checks = [
+        bad_numbers,
+        (subject_id == 0) | (theme_id == 0) | (name == '') | (question == '') | (answers_raw == '') | (correct_answer == ''),
+        ~subject_id.isin(list(subject_ids)),
+        theme_subject.isna(),
+        theme_subject != subject_id,
+        answers_raw.str.count('\\|') != 3,  # ровно 4 варианта через |
+        ~correct_answer.isin(CORRECT_ANSWERS),
+    ]
+    first_failed = pd.Series(np.select(checks, range(len(checks)), default=-1), index=df.index)
+    failed = first_failed >= 0
+
+    # Тексты ошибок собираем только для отбракованных строк
+    messages = [
+        ERROR_MESSAGES[check].format(subject_id=subject, theme_id=theme)
+        for check, subject, theme in zip(first_failed[failed], subject_id[failed], theme_id[failed])
+    ]
+    errors = pd.DataFrame({'row': df.index[failed] + 1, 'error': messages}, index=df.index[failed])
+
+    ok = ~failed
+    # Варианты ответов - в четыре колонки сразу для всех прошедших строк
+    parts = answers_raw[ok].str.split('|', expand=True).reindex(columns=range(4))
+    answers = [parts[column].astype(str).str.strip() for column in range(4)]
+    valid = pd.DataFrame({
+        'theme_id': theme_id[ok],
+        'subject_id': subject_id[ok],
+        'name': name[ok],
+        'question': question[ok],
+        'answer1': answers[0],
+        'answer2': answers[1],
+        'answer3': answers[2],
+        'answer4': answers[3],
+        'point': points[ok],
+        'correct_answer': correct_answer[ok],
+    })
+    return valid, errors
+
+
+def format_errors(errors, limit=5):
+    """Первые ошибки отчёта в виде строк для сообщения администратору"""
+    return [f"Строка {row}: {error}" for row, error in errors.head(limit).itertuples(index=False)]
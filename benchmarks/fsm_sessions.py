@@ -0,0 +1,92 @@
+"""Память после брошенных сессий FSM: SQLiteStorage против MemoryStorage.
+
+Запуск из корня проекта: python -m benchmarks.fsm_sessions [число сессий]
+"""
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.client import NavigationStates
+from app.storage import SQLiteStorage
+
+
+TTL = 86400  # как FSM_TTL по умолчанию
+
+
+def rss_mb():
+    """Резидентная память процесса (Linux); None, если /proc недоступен"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return None
+
+
+def session_data(number):
+    # Как у брошенного на середине теста: 10 вопросов, ответы на 4 из них
+    return {
+        'test_ids': list(range(number, number + 10)),
+        'current_question': 4,
+        'subject_id': number % 7,
+        'answers': 'АБВГ',
+    }
+
+
+async def abandon_sessions(storage, count):
+    for number in range(count):
+        key = StorageKey(bot_id=1, chat_id=number, user_id=number)
+        await storage.set_state(key, NavigationStates.test_in_progress)
+        await storage.set_data(key, session_data(number))
+
+
+async def count_rows(storage):
+    async with storage._db.execute('SELECT count(*) FROM fsm') as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def measure(storage, count):
+    gc.collect()
+    rss_before = rss_mb()
+    tracemalloc.start()
+    started = time.perf_counter()
+    await abandon_sessions(storage, count)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  запись: {elapsed:.1f} с ({count / elapsed:.0f} сессий/с)")
+    print(f"  Python-память после записи: {current / 2**20:.1f} МБ (пик {peak / 2**20:.1f} МБ)")
+    if rss_before is not None:
+        print(f"  рост RSS: {rss_mb() - rss_before:+.0f} МБ")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"🧪 {count} брошенных сессий test_in_progress\n")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fsm.db')
+        storage = SQLiteStorage(path=path, ttl=TTL, cleanup_interval=0)
+        print("💾 SQLiteStorage")
+        await measure(storage, count)
+        print(f"  в файле: {await count_rows(storage)} записей, {os.path.getsize(path) / 2**20:.1f} МБ")
+
+        # Сутки без обращений: дальше, чем TTL, ни одна сессия не проживёт
+        storage.ttl = 0
+        await storage.set_state(StorageKey(bot_id=1, chat_id=-1, user_id=-1), NavigationStates.test_in_progress)
+        print(f"  после истечения TTL: {await count_rows(storage) - 1} записей")
+        await storage.close()
+
+    print("\n🧠 MemoryStorage (было до перехода на SQLite)")
+    await measure(MemoryStorage(), count)
+    print("  брошенные сессии не удаляются никогда")
+
+if __name__ == '__main__':
+    asyncio.run(main())
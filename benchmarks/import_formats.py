@@ -0,0 +1,68 @@
+"""Скорость разбора одного и того же листа вопросов в каждом формате импорта.
+
+Запуск из корня проекта: python -m benchmarks.import_formats [число строк]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from app.files import open_table, pq, shutdown_files
+from app.jobs import PROGRESS_ROWS
+
+
+def question_rows(count):
+    return [[1, 'Химия', 1, 'Атом', f'Вопрос {number}', f'Текст вопроса {number}', '1|2|3|4', 'Б', 10]
+            for number in range(count)]
+
+
+def write_files(directory, rows):
+    """Один и тот же лист в каждом формате: {формат: путь}"""
+    df = pd.DataFrame(rows)
+    paths = {name: os.path.join(directory, f'questions.{name}') for name in ('xlsx', 'csv', 'jsonl', 'json', 'parquet')}
+    df.to_excel(paths['xlsx'], header=False, index=False)
+    df.to_csv(paths['csv'], header=False, index=False)
+    with open(paths['jsonl'], 'w', encoding='utf-8') as file:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False) + '\n')
+    with open(paths['json'], 'w', encoding='utf-8') as file:
+        json.dump(rows, file, ensure_ascii=False)
+    if pq is None:
+        del paths['parquet']  # без pyarrow Parquet не читается
+    else:
+        df.columns = [str(column) for column in df.columns]
+        df.to_parquet(paths['parquet'], index=False)
+    return paths
+
+
+async def read_all(path):
+    """Как импорт: файл читается пачками по PROGRESS_ROWS строк"""
+    reader = await open_table(path)
+    rows = 0
+    async for _, chunk in reader.chunks(PROGRESS_ROWS):
+        rows += len(chunk)
+    return rows
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = question_rows(count)
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"🧪 Разбор {count} вопросов\n")
+        paths = write_files(directory, rows)
+        print(f"{'формат':>8} | {'размер, МБ':>10} | {'время, с':>8} | {'строк/с':>9} | {'быстрее Excel':>13}")
+        excel = None
+        for name, path in paths.items():
+            started = time.perf_counter()
+            assert await read_all(path) == count
+            elapsed = time.perf_counter() - started
+            excel = excel or elapsed
+            print(f"{name:>8} | {os.path.getsize(path) / 2**20:>10.1f} | {elapsed:>8.2f} | {count / elapsed:>9.0f} | {excel / elapsed:>12.1f}x")
+    shutdown_files()
+
+if __name__ == '__main__':
+    asyncio.run(main())
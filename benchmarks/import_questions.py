@@ -0,0 +1,75 @@
+"""Импорт 100k вопросов: по одному add_test на строку против add_tests_bulk.
+
+Запуск из корня проекта: python -m benchmarks.import_questions [число вопросов]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.database.requests as rq
+from app.database.models import Base, Subject, Theme, make_engine
+
+
+ROW_BY_ROW_SAMPLE = 1000  # построчный импорт слишком долгий - меряем на части и пересчитываем
+CHUNK_ROWS = 1000
+
+
+def questions(count):
+    return [
+        {'theme_id': 1, 'subject_id': 1, 'name': f'Вопрос {number}', 'question': f'Текст вопроса {number}',
+         'answer1': '1', 'answer2': '2', 'answer3': '3', 'answer4': '4', 'point': 10, 'correct_answer': 'Б'}
+        for number in range(count)
+    ]
+
+
+async def row_by_row(tests):
+    for test in tests:
+        await rq.add_test(**test)
+
+
+async def one_transaction(tests):
+    await rq.add_tests_bulk(tests)
+
+
+async def chunked(tests):
+    await rq.add_tests_bulk(tests, chunk_size=CHUNK_ROWS)
+
+
+async def measure(title, method, tests, total):
+    # Рядом с yandex.db, а не в /tmp: там может быть tmpfs, где fsync ничего не стоит
+    with tempfile.TemporaryDirectory(dir='.') as directory:
+        engine = make_engine('production', f'sqlite+aiosqlite:///{os.path.join(directory, "bench.db")}')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(Subject.__table__).values(name='Химия'))
+            await conn.execute(insert(Theme.__table__).values(subject_id=1, name='Атом'))
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            token = rq.current_session.set(session)
+            try:
+                started = time.perf_counter()
+                await method(tests)
+                elapsed = (time.perf_counter() - started) * total / len(tests)
+            finally:
+                rq.current_session.reset(token)
+        await engine.dispose()
+    seconds = f'~{elapsed:.0f}' if len(tests) < total else f'{elapsed:.1f}'
+    print(f"{title:>32} | {seconds:>9} | {total / elapsed:>9.0f}")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    tests = questions(count)
+    print(f"🧪 Импорт {count} вопросов\n")
+    print(f"{'способ':>32} | {'время, с':>9} | {'строк/с':>9}")
+    await measure('add_test на каждую строку', row_by_row, tests[:ROW_BY_ROW_SAMPLE], count)
+    await measure('add_tests_bulk, одна транзакция', one_transaction, tests, count)
+    await measure(f'add_tests_bulk по {CHUNK_ROWS} строк', chunked, tests, count)
+    print(f"\n~ - оценка по первым {ROW_BY_ROW_SAMPLE} строкам")
+
+if __name__ == '__main__':
+    asyncio.run(main())
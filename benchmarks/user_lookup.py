@@ -0,0 +1,81 @@
+"""Стоимость get_user/set_user при росте числа пользователей: от 1k до 1M.
+
+Запуск из корня проекта: python -m benchmarks.user_lookup [максимум пользователей]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.database.requests as rq
+from app.database.models import Base, User, make_engine
+
+
+LOOKUPS = 2000
+INSERT_CHUNK = 50_000
+
+
+def sizes(limit):
+    size = 1000
+    while size <= limit:
+        yield size
+        size *= 10
+
+
+async def fill_users(session, start, stop):
+    for first in range(start, stop, INSERT_CHUNK):
+        rows = [{'tg_id': 10**9 + number, 'name': f'user{number}', 'is_active': True}
+                for number in range(first, min(first + INSERT_CHUNK, stop))]
+        await session.execute(insert(User.__table__), rows)
+    await session.commit()
+
+
+async def per_call_us(func, tg_ids):
+    started = time.perf_counter()
+    for tg_id in tg_ids:
+        await func(tg_id)
+    return (time.perf_counter() - started) / len(tg_ids) * 1e6
+
+
+async def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # Кэш профилей в обход: меряем сам запрос к SQLite
+    get_user = rq.get_user.__wrapped__
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = make_engine('production', f'sqlite+aiosqlite:///{os.path.join(directory, "bench.db")}')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def scan_user(tg_id):
+            # Тот же запрос без индекса - как было до ix_users_tg_id
+            await session.execute(text('SELECT * FROM users NOT INDEXED WHERE tg_id = :tg_id'), {'tg_id': tg_id})
+
+        print(f"{'пользователей':>14} | {'get_user, мкс':>14} | {'set_user, мкс':>14} | {'без индекса, мкс':>17}")
+        filled = 0
+        for size in sizes(limit):
+            async with session_maker() as session:
+                await fill_users(session, filled, size)
+            filled = size
+            tg_ids = [10**9 + random.randrange(size) for _ in range(LOOKUPS)]
+
+            async with session_maker() as session:
+                token = rq.current_session.set(session)
+                try:
+                    lookup = await per_call_us(get_user, tg_ids)
+                    visit = await per_call_us(rq.set_user, tg_ids[:LOOKUPS // 10])
+                    scan = await per_call_us(scan_user, tg_ids[:20])
+                finally:
+                    rq.current_session.reset(token)
+            print(f"{size:>14} | {lookup:>14.0f} | {visit:>14.0f} | {scan:>17.0f}")
+
+        await engine.dispose()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Запись результатов тестов: профиль default (настройки SQLite) против production (WAL).
+
+Запуск из корня проекта: python -m benchmarks.write_profiles [число завершённых тестов] [одновременных учеников]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.database.requests as rq
+from app.database.models import Base, User, Subject, Theme, make_engine
+
+
+USERS = 1000
+SUBJECTS = 5
+THEMES_PER_SUBJECT = 10
+
+
+async def seed(session_maker):
+    async with session_maker() as session:
+        await session.execute(insert(Subject.__table__), [{'name': f'Предмет {number}'} for number in range(SUBJECTS)])
+        await session.execute(insert(Theme.__table__), [
+            {'subject_id': subject_id, 'name': f'Тема {number}'}
+            for subject_id in range(1, SUBJECTS + 1) for number in range(THEMES_PER_SUBJECT)
+        ])
+        await session.execute(insert(User.__table__), [{'tg_id': number, 'is_active': True} for number in range(USERS)])
+        await session.commit()
+
+
+async def finish_test(session_maker, stats):
+    """Как в конце теста: ошибки по темам и баллы за предмет, одна сессия на апдейт"""
+    subject_id = random.randint(1, SUBJECTS)
+    first_theme = (subject_id - 1) * THEMES_PER_SUBJECT + 1
+    theme_errors = {theme_id: 1 for theme_id in random.sample(range(first_theme, first_theme + THEMES_PER_SUBJECT), 3)}
+    tg_id = random.randrange(USERS)
+    async with session_maker() as session:
+        token = rq.current_session.set(session)
+        try:
+            await rq.add_theme_errors(tg_id, theme_errors)
+            await rq.add_subject_score(tg_id, subject_id, 10)
+            stats['ok'] += 1
+        except OperationalError:
+            stats['locked'] += 1  # database is locked
+        finally:
+            rq.current_session.reset(token)
+
+
+async def measure(profile, count, concurrency):
+    # Рядом с yandex.db, а не в /tmp: там может быть tmpfs, где fsync ничего не стоит
+    with tempfile.TemporaryDirectory(dir='.') as directory:
+        engine = make_engine(profile, f'sqlite+aiosqlite:///{os.path.join(directory, "bench.db")}')
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        await seed(session_maker)
+
+        stats = {'ok': 0, 'locked': 0}
+        queue = iter(range(count))
+
+        async def student():
+            for _ in queue:
+                await finish_test(session_maker, stats)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(student() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        await engine.dispose()
+    print(f"{profile:>11} | {stats['ok'] / elapsed:>13.0f} | {elapsed:>7.1f} | {stats['locked']:>17}")
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f"🧪 {count} завершённых тестов, {concurrency} учеников одновременно\n")
+    print(f"{'профиль':>11} | {'тестов в сек.':>13} | {'время, с':>7} | {'database is locked':>17}")
+    for profile in ('default', 'production'):
+        await measure(profile, count, concurrency)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -9,7 +9,12 @@ from aiogram import Bot, Dispatcher
 from app.client import client
 from app.admin import admin
 from app.bulk_import import bulk_import
-from app.database.models import init_models
+from app.database.models import init_models, async_session
+from app.middlewares import DbSessionMiddleware, LastSeenMiddleware
+from app.storage import make_storage
+from app.database.cache import init_shared_cache, close_shared_cache
+from app.jobs import job_queue
+from app.files import shutdown_files
 
 from dotenv import load_dotenv
 
@@ -21,7 +26,9 @@ async def main():
     
     bot = Bot(token=os.getenv('TOKEN'))
     
-    dp = Dispatcher()
+    dp = Dispatcher(storage=make_storage())
+    dp.update.outer_middleware(DbSessionMiddleware(session_pool=async_session))
+    dp.update.outer_middleware(LastSeenMiddleware())
     dp.include_routers(admin, bulk_import, client)
     dp.startup.register(startup)
     dp.shutdown.register(shutdown)
@@ -30,11 +37,18 @@ async def main():
     await dp.start_polling(bot)
     
 
-async def startup(dispatcher: Dispatcher):
+async def startup(dispatcher: Dispatcher, bot: Bot):
     await init_models()
+    if await init_shared_cache():
+        print('Redis cache connected')
+    await job_queue.start(bot)
     print('Bot starting up...')
 
 async def shutdown(dispatcher: Dispatcher):
+    await job_queue.stop()
+    shutdown_files()
+    await close_shared_cache()
+    await dispatcher.storage.close()
     print('Bot shutting down...')
     
     
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+# До импорта app: база в памяти вместо yandex.db, FSM в памяти
+os.environ['DB_PROFILE'] = 'memory'
+os.environ.setdefault('FSM_STORAGE', 'memory')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption('--runslow', action='store_true', help='запустить долгие тесты на больших файлах')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: долгий тест на больших данных (запускается с --runslow)')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--runslow'):
+        return
+    skip = pytest.mark.skip(reason='долгий тест: запустите с --runslow')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip)
+
+
+class FakeRedis:
+    """Redis в памяти процесса: get/set/delete/incr, как их использует бот"""
+    def __init__(self):
+        self.data = {}
+        self.hits = 0
+
+    async def get(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode()
+        elif isinstance(value, int):
+            value = str(value).encode()
+        self.data[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    async def publish(self, channel, message):
+        return 0
+
+    async def close(self):
+        pass
+
+
+class FakeBot:
+    """Bot, который ничего не отправляет, а запоминает сообщения и файлы"""
+    def __init__(self):
+        self.sent = []
+        self.edited = []
+        self.documents = []  # (chat_id, содержимое файла, подпись)
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        self.documents.append((chat_id, document.data, caption))
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.edited.append((chat_id, text))
+
+
+class FakeJob:
+    """Задача для прямого вызова обработчика из app.jobs без очереди"""
+    def __init__(self, bot, payload=None, chat_id=None):
+        self.bot = bot
+        self.payload = payload or {}
+        self.state = {}
+        self.chat_id = chat_id
+        self.done = 0
+        self.total = None
+
+    async def progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+
+
+async def reset_database():
+    """Пустая схема в общей базе в памяти"""
+    from app.database.cache import catalog_cache
+    from app.database.models import Base, engine, init_models
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_models()
+    catalog_cache.invalidate()
+
+
+def run(coro):
+    """asyncio.run для теста: соединение с базой закрывается в том же цикле событий, что и открылось"""
+    from app.database.models import engine
+
+    async def scenario():
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def fake_bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def shared_cache(fake_redis):
+    """SharedCache поверх FakeRedis, подключённый как общий кэш бота на время теста"""
+    import app.database.cache as cache
+
+    shared = cache.SharedCache.__new__(cache.SharedCache)
+    shared.redis = fake_redis
+    shared.catalog_ttl = 60
+    shared.profile_ttl = 60
+    shared.version = 0
+    shared._listener = None
+    cache.shared_cache = shared
+    yield shared
+    cache.shared_cache = None
+    cache.catalog_cache.invalidate()
+
+
+@pytest.fixture
+def redis_url(tmp_path):
+    """Настоящий redis-server на свободном порту; без redis-server тест пропускается"""
+    binary = shutil.which('redis-server')
+    if binary is None:
+        pytest.skip('redis-server не установлен')
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [binary, '--port', str(port), '--bind', '127.0.0.1', '--save', '', '--appendonly', 'no', '--dir', str(tmp_path)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    pytest.skip('redis-server не запустился')
+                time.sleep(0.05)
+        yield f'redis://127.0.0.1:{port}/0'
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
@@ -0,0 +1,172 @@
+import asyncio
+import csv
+import io
+import time
+
+from openpyxl import Workbook, load_workbook
+
+import app.database.requests as rq
+import app.files as files
+from app.admin import check_questions_job, import_questions_job
+from conftest import FakeJob, reset_database, run
+
+
+ROWS = 5000
+PROBE_INTERVAL = 0.005
+MAX_P99_LAG = 0.05  # сек.: нажатие кнопки во время импорта не должно ждать дольше
+
+
+def question_rows(count):
+    return [[1, 'Химия', 1, 'Атом', f'Вопрос {i}', f'Текст вопроса {i}', '1|2|3|4', 'Б', 10] for i in range(count)]
+
+
+def write_sheet(path, rows):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        csv.writer(file).writerows(rows)
+
+
+async def seed_catalog():
+    await reset_database()
+    await rq.add_subject('Химия')
+    await rq.add_theme(1, 'Атом', '')
+
+
+def test_event_loop_stays_responsive_during_import(tmp_path, fake_bot):
+    path = tmp_path / 'questions.xlsx'
+    write_sheet(path, question_rows(ROWS))
+
+    async def scenario():
+        await seed_catalog()
+        # Пулы запускаются один раз за жизнь бота - их запуск в замер не входит
+        files._sheet_pool().submit(int).result()
+        await files.run_in_process(int)
+
+        lags = []
+        running = True
+
+        async def probe():
+            while running:
+                started = time.perf_counter()
+                await asyncio.sleep(PROBE_INTERVAL)
+                lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+        task = asyncio.create_task(probe())
+        await import_questions_job(FakeJob(fake_bot, {'path': str(path)}, chat_id=1))
+        running = False
+        await task
+
+        assert len(await rq.get_tests_by_subject(1)) == ROWS
+        assert 'Добавлено вопросов: 5000' in fake_bot.sent[-1][1]
+        lags.sort()
+        assert lags[int(len(lags) * 0.99)] < MAX_P99_LAG
+
+    run(scenario())
+
+
+def spy_writes(monkeypatch):
+    """Записывает, сколько вопросов каждый вызов upsert_tests_bulk добавил и обновил"""
+    writes = []
+    upsert_tests_bulk = rq.upsert_tests_bulk
+
+    async def spy(new_tests, changed_tests):
+        writes.append((len(new_tests), len(changed_tests)))
+        return await upsert_tests_bulk(new_tests, changed_tests)
+
+    monkeypatch.setattr(rq, 'upsert_tests_bulk', spy)
+    return writes
+
+
+async def import_file(bot, path, mode=None):
+    job = FakeJob(bot, {'path': str(path), 'mode': mode} if mode else {'path': str(path)}, chat_id=1)
+    await import_questions_job(job)
+    return job.state
+
+
+async def stored_tests():
+    return {test.name: test for test in await rq.get_tests()}
+
+
+def test_upsert_writes_only_changed_rows(tmp_path, fake_bot, monkeypatch):
+    total, edited = 50, [3, 17, 42]
+    rows = question_rows(total)
+    write_sheet(tmp_path / 'bank.xlsx', rows)
+    for index in edited:
+        rows[index][6] = 'один|два|три|четыре'  # исправили варианты ответа
+    write_sheet(tmp_path / 'fixed.xlsx', rows)
+
+    async def scenario():
+        await seed_catalog()
+        assert (await import_file(fake_bot, tmp_path / 'bank.xlsx'))['added'] == total
+        before = await stored_tests()
+
+        writes = spy_writes(monkeypatch)
+        state = await import_file(fake_bot, tmp_path / 'fixed.xlsx', mode='upsert')
+        assert (state['added'], state['updated'], state['unchanged']) == (0, len(edited), total - len(edited))
+        assert sum(new for new, _ in writes) == 0 and sum(changed for _, changed in writes) == len(edited)
+
+        after = await stored_tests()
+        changed = {name for name in after if after[name].content_hash != before[name].content_hash}
+        assert changed == {f'Вопрос {index}' for index in edited}
+        assert after['Вопрос 3'].answer1 == 'один' and after['Вопрос 3'].id == before['Вопрос 3'].id
+
+    run(scenario())
+
+
+def test_csv_reimport_of_xlsx_bank_writes_nothing(tmp_path, fake_bot, monkeypatch):
+    rows = question_rows(20)
+    write_sheet(tmp_path / 'bank.xlsx', rows)
+    write_csv(tmp_path / 'bank.csv', rows)
+
+    async def scenario():
+        await seed_catalog()
+        await import_file(fake_bot, tmp_path / 'bank.xlsx')
+        before = await stored_tests()
+
+        writes = spy_writes(monkeypatch)
+        state = await import_file(fake_bot, tmp_path / 'bank.csv', mode='upsert')
+        # Ячейки CSV читаются строками, но после проверки хэши те же, что у вопросов из Excel
+        assert (state['added'], state['updated'], state['unchanged']) == (0, 0, len(rows))
+        assert all(new == changed == 0 for new, changed in writes)
+        assert {name: test.content_hash for name, test in (await stored_tests()).items()} == \
+            {name: test.content_hash for name, test in before.items()}
+
+    run(scenario())
+
+
+def test_check_reports_every_bad_row_without_writing(tmp_path, fake_bot):
+    rows = question_rows(6)
+    rows[1][7] = 'Д'                     # неверная буква
+    rows[2][2] = 99                      # нет такой темы
+    rows[3][6] = '1|2'                   # мало вариантов
+    rows[4][4] = 'Вопрос 0'              # повтор строки 1
+    rows.append(list(rows[5]))           # повтор строки 6
+    write_sheet(tmp_path / 'questions.xlsx', rows)
+
+    async def scenario():
+        await seed_catalog()
+        await check_questions_job(FakeJob(fake_bot, {'path': str(tmp_path / 'questions.xlsx')}, chat_id=1))
+        assert await rq.get_tests() == ()
+
+        (chat_id, report, caption), = fake_bot.documents
+        assert 'С ошибками: 5' in caption
+        sheet = load_workbook(io.BytesIO(report)).active
+        problems = {row[0]: row[1] for row in sheet.iter_rows(min_row=2, values_only=True)}
+        assert problems == {
+            2: 'правильный ответ должен быть А, Б, В или Г',
+            3: 'тема с ID 99 не найдена',
+            4: 'должно быть ровно 4 варианта ответа (через |)',
+            5: 'повторяет вопрос из строки 1',
+            7: 'повторяет вопрос из строки 6',
+        }
+        # В отчёте - и исходные ячейки строки
+        assert next(sheet.iter_rows(min_row=3, max_row=3, values_only=True))[2:] == tuple(rows[2])
+
+    run(scenario())
@@ -0,0 +1,105 @@
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import app.broadcast as broadcast
+import app.database.requests as rq
+from app.broadcast import digest_job
+from conftest import FakeBot, FakeJob, reset_database, run
+
+
+class FlakyBot(FakeBot):
+    """Первая отправка в chat_id из retry_chats - RetryAfter, отправки в blocked_chats - бот заблокирован"""
+    def __init__(self, retry_chats=(), blocked_chats=()):
+        super().__init__()
+        self.retry_chats = set(retry_chats)
+        self.blocked_chats = set(blocked_chats)
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in self.retry_chats:
+            self.retry_chats.discard(chat_id)
+            raise TelegramRetryAfter(method, 'Too Many Requests: retry after 1', retry_after=1)
+        if chat_id in self.blocked_chats:
+            raise TelegramForbiddenError(method, 'Forbidden: bot was blocked by the user')
+        await super().send_message(chat_id, text, parse_mode)
+
+
+def fast_limits(monkeypatch, rate=100):
+    monkeypatch.setattr(broadcast, 'global_limiter', broadcast.RateLimiter(rate))
+    monkeypatch.setattr(broadcast, 'chat_limiter', broadcast.ChatLimiter(interval=0.1))
+
+
+def test_digest_sends_one_message_per_user(fake_bot):
+    async def scenario():
+        await reset_database()
+        for tg_id in (101, 102, 103):
+            await rq.set_user(tg_id)
+        await rq.add_subject('Химия')
+        await rq.add_subject('Математика')
+        chemistry, math = [subject.id for subject in await rq.get_subjects()]
+        await rq.add_subject_score(101, chemistry, 10)
+        await rq.add_subject_score(102, chemistry, 10)
+        await rq.add_subject_score(102, math, 10)
+
+        await rq.add_content_event('subject', name='Физика')
+        await rq.add_content_event('theme', name='Кислоты', subject_id=chemistry)
+        await rq.add_content_event('question', count=3, subject_id=math)
+
+        await digest_job(FakeJob(fake_bot))
+        texts = dict(fake_bot.sent)
+        assert sorted(chat_id for chat_id, _ in fake_bot.sent) == [101, 102, 103]
+        assert 'Физика' in texts[103] and 'Кислоты' not in texts[103] and 'Новых вопросов' not in texts[103]
+        assert 'Кислоты' in texts[101] and 'Новых вопросов' not in texts[101]
+        assert 'Кислоты' in texts[102] and 'Новых вопросов: <b>3</b>' in texts[102]
+
+    run(scenario())
+
+
+def test_subject_only_digest_skips_other_users(fake_bot):
+    async def scenario():
+        await reset_database()
+        for tg_id in (101, 102):
+            await rq.set_user(tg_id)
+        await rq.add_subject('Химия')
+        chemistry = (await rq.get_subjects())[0].id
+        await rq.add_subject_score(101, chemistry, 10)
+        await rq.add_content_event('theme', name='Кислоты', subject_id=chemistry)
+        await rq.add_content_event('question', subject_id=chemistry)
+
+        await digest_job(FakeJob(fake_bot))
+        assert [chat_id for chat_id, _ in fake_bot.sent] == [101]
+
+    run(scenario())
+
+
+def test_retry_after_and_blocked_chat(monkeypatch):
+    fast_limits(monkeypatch)
+
+    async def scenario():
+        await reset_database()
+        for tg_id in (101, 102, 103):
+            await rq.set_user(tg_id)
+        bot = FlakyBot(retry_chats=[102], blocked_chats=[103])
+        stats = await broadcast.broadcast(bot, [101, 102, 103], 'Новости')
+
+        assert sorted(chat_id for chat_id, _ in bot.sent) == [101, 102]
+        assert (stats.total, stats.sent, stats.retried, stats.failed, stats.deactivated) == (3, 2, 1, 1, 1)
+        # После RetryAfter следующие отправки ждали retry_after секунд
+        assert stats.elapsed >= 1
+        assert not (await rq.get_user(103)).is_active
+        assert (await rq.get_user(101)).is_active
+
+    run(scenario())
+
+
+def test_broadcast_respects_rate(monkeypatch):
+    fast_limits(monkeypatch, rate=50)
+
+    async def scenario():
+        bot = FakeBot()
+        stats = await broadcast.broadcast(bot, range(11), 'Новости')
+        assert stats.sent == 11
+        # 11 отправок при 50 в секунду - не быстрее, чем за 10 интервалов
+        assert stats.elapsed >= 10 / 50
+
+    run(scenario())
@@ -0,0 +1,124 @@
+import asyncio
+import inspect
+
+import app.database.cache as cache
+import app.database.requests as rq
+from conftest import reset_database, run
+
+
+CATALOG_QUERIES = [
+    func for _, func in inspect.getmembers(rq, inspect.iscoroutinefunction)
+    if func.__code__.co_qualname == 'cached_catalog.<locals>.inner'
+]
+
+
+async def seed():
+    await rq.add_subject('Химия')
+    subject = (await rq.get_subjects())[0]
+    await rq.add_theme(subject.id, 'Строение атома', 'Описание')
+    theme = (await rq.get_themes())[0]
+    await rq.add_test(theme.id, subject.id, 'Валентность', 'Сколько?', '1', '2', '3', '4', 10, 'Б')
+    test = (await rq.get_tests())[0]
+    return {
+        'subject_id': subject.id,
+        'theme_id': theme.id,
+        'theme_ids': [theme.id],
+        'test_id': test.id,
+        'test_ids': [test.id],
+    }
+
+
+def call_args(func, samples):
+    params = list(inspect.signature(func).parameters)[1:]  # первый параметр - сессия
+    return [samples[name] for name in params]
+
+
+def test_catalog_queries_found():
+    names = {func.__name__ for func in CATALOG_QUERIES}
+    assert {'get_themes_by_ids', 'get_tests_by_ids', 'get_subjects'} <= names
+
+
+def test_catalog_round_trip_through_redis(fake_redis, shared_cache):
+    async def scenario():
+        await reset_database()
+        samples = await seed()
+        for func in CATALOG_QUERIES:
+            args = call_args(func, samples)
+            cache.catalog_cache.invalidate()
+            from_db = await func(*args)
+            cache.catalog_cache.invalidate()
+            hits = fake_redis.hits
+            from_redis = await func(*args)
+            assert fake_redis.hits == hits + 1, func.__name__
+            assert type(from_redis) is type(from_db), func.__name__
+            assert from_redis == from_db, func.__name__
+
+    run(scenario())
+
+
+def test_unpicklable_snapshot_falls_back_to_db(fake_redis, shared_cache):
+    async def scenario():
+        await shared_cache.put_catalog('key', lambda: None, 0)
+        assert fake_redis.data == {}
+        fake_redis.data[shared_cache._catalog_key('key', 0)] = b'not a pickle'
+        assert await shared_cache.get_catalog('key') is None
+
+    run(scenario())
+
+
+def test_corrupt_profile_read_from_db(fake_redis, shared_cache):
+    async def scenario():
+        await reset_database()
+        await rq.set_user(101)
+        fake_redis.data['profile:101'] = b'not a pickle'
+        user = await rq.get_user(101)
+        assert user.tg_id == 101
+        # Испорченная запись заменена свежим профилем из БД
+        assert await shared_cache.get_profile(101) == user
+
+    run(scenario())
+
+
+async def wait_for(condition, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await condition():
+        assert asyncio.get_running_loop().time() < deadline, 'не дождались'
+        await asyncio.sleep(0.02)
+
+
+def test_admin_write_invalidates_other_process(redis_url):
+    async def scenario():
+        await reset_database()
+        admin_process = cache.SharedCache(redis_url)
+        other_process = cache.SharedCache(redis_url)
+        await admin_process.start()
+        await other_process.start()
+        try:
+            async def subscribed():
+                return dict(await admin_process.redis.pubsub_numsub(cache.SharedCache.CHANNEL))[cache.SharedCache.CHANNEL.encode()] >= 2
+            await wait_for(subscribed)
+
+            # Снимок каталога, закэшированный другим процессом
+            cache.shared_cache = other_process
+            assert len(await rq.get_subjects()) == 0
+            assert await other_process.get_catalog(('get_subjects', (), ())) is not None
+
+            # Админ пишет через свой процесс: сброс уходит в канал
+            cache.shared_cache = admin_process
+            await rq.add_subject('Химия')
+            local_version = cache.catalog_cache.version
+
+            async def invalidated():
+                return other_process.version == admin_process.version and cache.catalog_cache.version > local_version
+            await wait_for(invalidated)
+
+            # Старый снимок больше не читается: ключи кэша содержат версию
+            cache.shared_cache = other_process
+            assert [subject.name for subject in await rq.get_subjects()] == ['Химия']
+        finally:
+            cache.shared_cache = None
+            cache.catalog_cache.invalidate()
+            await admin_process.stop()
+            await other_process.stop()
+
+    run(scenario())
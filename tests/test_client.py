@@ -0,0 +1,53 @@
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import app.database.requests as rq
+from app.client import next_question
+from conftest import reset_database, run
+
+
+async def seed_questions(count):
+    await rq.add_subject('Химия')
+    subject = (await rq.get_subjects())[0]
+    await rq.add_theme(subject.id, 'Строение атома', 'Описание')
+    theme = (await rq.get_themes())[0]
+    for number in range(count):
+        await rq.add_test(theme.id, subject.id, f'Вопрос {number}', 'Сколько?', '1', '2', '3', '4', 10, 'Б')
+    return [test.id for test in await rq.get_tests()]
+
+
+def make_state():
+    return FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+
+
+def test_next_question_skips_deleted():
+    async def scenario():
+        await reset_database()
+        test_ids = await seed_questions(3)
+        state = make_state()
+        await state.update_data(test_ids=test_ids, current_question=1, answers='А')
+        await rq.delete_test(test_ids[1])
+
+        current_q, test = await next_question(state)
+        assert current_q == 2
+        assert test.id == test_ids[2]
+        data = await state.get_data()
+        assert data['current_question'] == 2
+        assert data['answers'] == 'А-'
+
+    run(scenario())
+
+
+def test_next_question_finishes_when_rest_deleted():
+    async def scenario():
+        await reset_database()
+        test_ids = await seed_questions(2)
+        state = make_state()
+        await state.update_data(test_ids=test_ids, current_question=1, answers='А')
+        await rq.delete_test(test_ids[1])
+
+        assert await next_question(state) == (2, None)
+        assert (await state.get_data())['answers'] == 'А-'
+
+    run(scenario())
@@ -0,0 +1,188 @@
+import asyncio
+import inspect
+
+from sqlalchemy.exc import OperationalError
+
+import app.database.requests as rq
+import app.jobs as jobs
+from app.jobs import JobQueue, job_handler
+from conftest import reset_database, run
+
+
+ITEMS = 5
+processed = []  # (задача, элемент) в порядке обработки
+gate = {}  # элемент -> событие, которого ждёт обработчик перед этим элементом
+
+
+@job_handler('test_items', 'Тестовая задача')
+async def items_job(job):
+    """Обрабатывает элементы по одному; после каждого сохраняет, сколько сделано"""
+    for item in range(job.state.get('next', 0), ITEMS):
+        if item in gate:
+            await gate[item].wait()
+        processed.append((job.id, item))
+        job.state['next'] = item + 1
+        await job.progress(item + 1, ITEMS)
+
+
+async def job_status(job_id):
+    return {job.id: job.status for job in await rq.get_jobs(limit=100)}[job_id]
+
+
+async def job_status_is(job_id, status):
+    return await job_status(job_id) == status
+
+
+async def wait_for(condition, timeout=5):
+    """Ждёт, пока condition() (обычная функция или корутина) не станет истинным"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        result = condition()
+        if inspect.isawaitable(result):
+            result = await result
+        if result:
+            return
+        assert asyncio.get_running_loop().time() < deadline, 'не дождались'
+        await asyncio.sleep(0.01)
+
+
+async def stop_idle(queue):
+    """Останавливает воркеров, когда они ждут задач или ворот, а не посреди запроса:
+    отмена во время запроса сбрасывает соединение, а с ним - всю базу в памяти"""
+    await asyncio.sleep(0.1)
+    await queue.stop()
+
+
+def prepare(monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.5)
+    processed.clear()
+    gate.clear()
+
+
+def test_claim_takes_oldest_ready_job(monkeypatch):
+    prepare(monkeypatch)
+
+    async def scenario():
+        await reset_database()
+        first = await rq.add_job('test_items', '{}')
+        await rq.add_job('test_items', '{}', delay=3600)
+        second = await rq.add_job('test_items', '{}')
+
+        assert (await rq.claim_job()).id == first
+        assert (await rq.claim_job()).id == second
+        assert await rq.claim_job() is None  # отложенная задача ещё не готова
+        assert await job_status(first) == 'running'
+
+    run(scenario())
+
+
+def test_worker_runs_job_to_done(monkeypatch, fake_bot):
+    prepare(monkeypatch)
+
+    async def scenario():
+        await reset_database()
+        queue = JobQueue(workers=1)
+        await queue.start(fake_bot)
+        try:
+            job_id = await queue.enqueue('test_items', {})
+            await wait_for(lambda: job_status_is(job_id, 'done'))
+        finally:
+            await stop_idle(queue)
+        assert processed == [(job_id, item) for item in range(ITEMS)]
+
+    run(scenario())
+
+
+def test_worker_survives_database_errors(monkeypatch, fake_bot):
+    prepare(monkeypatch)
+    claim_job = rq.claim_job
+    failures = {'claim': 1, 'finish': 1}
+
+    async def flaky_claim():
+        if failures['claim']:
+            failures['claim'] -= 1
+            raise OperationalError('UPDATE jobs', {}, Exception('database is locked'))
+        return await claim_job()
+
+    finish_job = rq.finish_job
+
+    async def flaky_finish(job_id, status, error=None):
+        if failures['finish']:
+            failures['finish'] -= 1
+            raise OperationalError('UPDATE jobs', {}, Exception('database is locked'))
+        return await finish_job(job_id, status, error)
+
+    monkeypatch.setattr(rq, 'claim_job', flaky_claim)
+    monkeypatch.setattr(rq, 'finish_job', flaky_finish)
+
+    async def scenario():
+        await reset_database()
+        queue = JobQueue(workers=1)
+        await queue.start(fake_bot)
+        try:
+            first = await queue.enqueue('test_items', {})
+            # Статус первой задачи не сохранился, но воркер жив и берёт следующую
+            await wait_for(lambda: len(processed) == ITEMS)
+            second = await queue.enqueue('test_items', {})
+            await wait_for(lambda: job_status_is(second, 'done'))
+            assert not any(task.done() for task in queue._tasks)
+        finally:
+            await stop_idle(queue)
+        assert await job_status(first) == 'running'  # продолжится после перезапуска
+        assert failures == {'claim': 0, 'finish': 0}
+
+    run(scenario())
+
+
+def test_cancel_pending_and_running(monkeypatch, fake_bot):
+    prepare(monkeypatch)
+    gate[2] = asyncio.Event()
+
+    async def scenario():
+        await reset_database()
+        queue = JobQueue(workers=1)
+        await queue.start(fake_bot)
+        try:
+            running = await queue.enqueue('test_items', {})
+            pending = await queue.enqueue('test_items', {})
+            await wait_for(lambda: len(processed) == 2)
+
+            assert (await queue.cancel(pending)).status == 'pending'
+            assert (await queue.cancel(running)).status == 'running'
+            gate[2].set()
+            # Обработчик замечает отмену на следующем сохранении прогресса
+            await wait_for(lambda: len(processed) == 3)
+        finally:
+            await stop_idle(queue)
+        assert processed == [(running, 0), (running, 1), (running, 2)]
+        assert await job_status(running) == 'cancelled'
+        assert await job_status(pending) == 'cancelled'
+        assert await queue.cancel(running) is None  # завершённую задачу не отменить
+
+    run(scenario())
+
+
+def test_requeued_job_resumes_from_state(monkeypatch, fake_bot):
+    prepare(monkeypatch)
+    gate[3] = asyncio.Event()
+
+    async def scenario():
+        await reset_database()
+        queue = JobQueue(workers=1)
+        await queue.start(fake_bot)
+        job_id = await queue.enqueue('test_items', {})
+        await wait_for(lambda: len(processed) == 3)
+        await stop_idle(queue)  # остановка бота посреди задачи
+        assert await job_status(job_id) == 'running'
+
+        gate[3].set()
+        restarted = JobQueue(workers=1)
+        await restarted.start(fake_bot)  # requeue_running_jobs
+        try:
+            await wait_for(lambda: job_status_is(job_id, 'done'))
+        finally:
+            await stop_idle(restarted)
+        # Уже сделанные элементы не повторяются
+        assert processed == [(job_id, item) for item in range(ITEMS)]
+
+    run(scenario())
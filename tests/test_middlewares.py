@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from sqlalchemy import text
+
+import app.database.requests as rq
+from app.database.models import engine
+from app.middlewares import LastSeenMiddleware
+from conftest import reset_database, run
+
+
+INACTIVE = {'inactive_days': 30}
+
+
+async def handler(event, data):
+    return 'handled'
+
+
+async def forget_visits():
+    async with engine.begin() as conn:
+        await conn.execute(text("UPDATE users SET last_seen = datetime('now', '-60 days')"))
+
+
+def test_any_update_marks_user_as_seen(monkeypatch):
+    async def scenario():
+        await reset_database()
+        await rq.set_user(101)
+        await forget_visits()
+        assert await rq.count_users(segment=INACTIVE) == 1
+
+        middleware = LastSeenMiddleware()
+        data = {'event_from_user': SimpleNamespace(id=101, is_bot=False)}
+        # Кнопка "Моя статистика" - не /start и не пройденный тест
+        assert await middleware(handler, object(), data) == 'handled'
+        assert await rq.count_users(segment=INACTIVE) == 0
+
+        # Следующие апдейты в течение часа в БД не пишут
+        touched = []
+        monkeypatch.setattr(rq, 'touch_user', lambda tg_id: touched.append(tg_id))
+        await middleware(handler, object(), data)
+        assert touched == []
+
+    run(scenario())
+
+
+def test_touch_reactivates_blocked_user():
+    async def scenario():
+        await reset_database()
+        await rq.set_user(101)
+        await rq.deactivate_users([101])
+        await rq.touch_user(101)
+        assert (await rq.get_user(101)).is_active
+
+    run(scenario())
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+from aiogram.fsm.storage.base import StorageKey
+
+from app.storage import SQLiteStorage, make_redis_storage, pack_data, unpack_data
+from conftest import run
+
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=2)
+DATA = {'test_ids': [3, 1, 2], 'current_question': 1, 'answers': 'Б', 'segment': {'kind': 'all'}}
+
+
+def test_pack_data_is_compact_json():
+    raw = pack_data(DATA)
+    assert ' ' not in raw
+    assert unpack_data(raw) == DATA
+    assert unpack_data(raw.encode()) == DATA
+
+
+def test_unpack_data_drops_unreadable_records():
+    assert unpack_data(b'\xfb\x02\x00\x00\x00') == {}
+
+
+def test_sqlite_storage_round_trip(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(path=os.path.join(tmp_path, 'fsm.db'))
+        await storage.set_state(KEY, 'NavigationStates:test_in_progress')
+        await storage.set_data(KEY, DATA)
+        await storage.close()
+
+        reopened = SQLiteStorage(path=os.path.join(tmp_path, 'fsm.db'))
+        assert await reopened.get_state(KEY) == 'NavigationStates:test_in_progress'
+        assert await reopened.get_data(KEY) == DATA
+        await reopened.close()
+
+    run(scenario())
+
+
+def test_sqlite_storage_evicts_idle_sessions(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(path=os.path.join(tmp_path, 'fsm.db'), ttl=1, cleanup_interval=0)
+        for user_id in range(100):
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            await storage.set_state(key, 'NavigationStates:test_in_progress')
+            await storage.set_data(key, DATA)
+        await asyncio.sleep(1.1)
+        assert await storage.get_data(StorageKey(bot_id=1, chat_id=0, user_id=0)) == {}
+
+        await storage.set_state(KEY, 'NavigationStates:main_menu')
+        async with storage._db.execute('SELECT count(*) FROM fsm') as cursor:
+            assert (await cursor.fetchone())[0] == 1
+        await storage.close()
+
+    run(scenario())
+
+
+def test_redis_storage_round_trip(fake_redis):
+    async def scenario():
+        storage = make_redis_storage('redis://localhost', ttl=60)
+        storage.redis = fake_redis
+        await storage.set_data(KEY, DATA)
+        assert await storage.get_data(KEY) == DATA
+        fake_redis.data[storage.key_builder.build(KEY, 'data')] = b'\xfb\x02\x00\x00\x00'
+        assert await storage.get_data(KEY) == {}
+
+    run(scenario())
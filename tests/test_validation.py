@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from app.validation import validate_questions
+
+
+SUBJECTS = {1: 'Химия', 2: 'Математика'}
+THEME_SUBJECTS = {10: 1, 20: 2}
+
+ROWS = [
+    [1, 'Химия', 10, 'Атом', 'Вопрос 1', 'Текст', ' 1 | 2|3 |4 ', 'б', 5],   # проходит
+    [2, 'Математика', 20, 'Алгебра', 'Вопрос 2', 'Текст', 'а|б|в|г', 'Г', None],  # проходит, баллы по умолчанию
+    ['x', 'Химия', 10, 'Атом', 'Вопрос 3', 'Текст', '1|2|3|4', 'А', 5],      # не число
+    [1, 'Химия', 10, 'Атом', 'Вопрос 4', 'Текст', '1|2|3|4', 'А', 'много'],  # не число в баллах
+    [1, 'Химия', None, 'Атом', None, 'Текст', '1|2', 'Д', 5],               # пропуски важнее остальных ошибок
+    [0, 'Химия', 10, 'Атом', 'Вопрос 6', 'Текст', '1|2|3|4', 'А', 5],        # ID 0 - как пропуск
+    [3, 'Физика', 30, 'Сила', 'Вопрос 7', 'Текст', '1|2', 'Д', 5],          # нет предмета (и темы, и вариантов)
+    [1, 'Химия', 30, 'Сила', 'Вопрос 8', 'Текст', '1|2', 'Д', 5],           # нет темы
+    [1, 'Химия', 20, 'Алгебра', 'Вопрос 9', 'Текст', '1|2', 'Д', 5],        # тема другого предмета
+    [1, 'Химия', 10, 'Атом', 'Вопрос 10', 'Текст', '1|2|3', 'Д', 5],        # три варианта
+    [1, 'Химия', 10, 'Атом', 'Вопрос 11', 'Текст', '1|2|3|4|5', 'А', 5],    # пять вариантов
+    [1, 'Химия', 10, 'Атом', 'Вопрос 12', 'Текст', '1|2|3|4', 'Д', 5],      # неверная буква
+    [1, 'Химия', 10, 'Атом', '  ', 'Текст', '1|2|3|4', 'А', 5],             # пустое название после strip
+    [1.0, 'Химия', '10', 'Атом', 'Вопрос 14', 'Текст', '|||', 'в', '7'],   # числа строками, пустые варианты
+]
+
+
+def legacy_validate(df, subjects_dict, themes_dict):
+    """Проверка из прежнего process_questions_file (цикл iterrows) без записи в БД"""
+    errors = []
+    valid = {}
+    for index, row in df.iterrows():
+        try:
+            subject_id = int(row[0]) if pd.notna(row[0]) else None
+            theme_id = int(row[2]) if pd.notna(row[2]) else None
+            question_name = str(row[4]).strip() if pd.notna(row[4]) else None
+            question_text = str(row[5]).strip() if pd.notna(row[5]) else None
+            answers_raw = str(row[6]).strip() if pd.notna(row[6]) else None
+            correct_answer = str(row[7]).strip().upper() if pd.notna(row[7]) else None
+            points = int(row[8]) if pd.notna(row[8]) else 10
+            if not all([subject_id, theme_id, question_name, question_text, answers_raw, correct_answer]):
+                errors.append(f"Строка {index+1}: пропущены обязательные поля")
+                continue
+            if subject_id not in subjects_dict:
+                errors.append(f"Строка {index+1}: предмет с ID {subject_id} не найден")
+                continue
+            if theme_id not in themes_dict:
+                errors.append(f"Строка {index+1}: тема с ID {theme_id} не найдена")
+                continue
+            if themes_dict[theme_id] != subject_id:
+                errors.append(f"Строка {index+1}: тема {theme_id} не принадлежит предмету {subject_id}")
+                continue
+            answers = [a.strip() for a in answers_raw.split('|')]
+            if len(answers) != 4:
+                errors.append(f"Строка {index+1}: должно быть ровно 4 варианта ответа (через |)")
+                continue
+            if correct_answer not in ['А', 'Б', 'В', 'Г']:
+                errors.append(f"Строка {index+1}: правильный ответ должен быть А, Б, В или Г")
+                continue
+            valid[index] = [theme_id, subject_id, question_name, question_text, *answers, points, correct_answer]
+        except Exception:
+            errors.append(f"Строка {index+1}: ошибка обработки")
+    return errors, valid
+
+
+def test_matches_legacy_row_loop():
+    df = pd.DataFrame(ROWS).replace({None: np.nan})
+    valid, errors = validate_questions(df, SUBJECTS, THEME_SUBJECTS)
+    legacy_errors, legacy_valid = legacy_validate(df, SUBJECTS, THEME_SUBJECTS)
+
+    messages = [f"Строка {row}: {error}" for row, error in errors.itertuples(index=False)]
+    # Прежний цикл писал текст исключения - сравниваем только начало таких сообщений
+    messages = [message.split(' - ')[0] if 'ошибка обработки' in message else message for message in messages]
+    assert messages == legacy_errors  # тексты, порядок и первая ошибка строки совпадают
+    assert {index: row.tolist() for index, row in valid.iterrows()} == legacy_valid
+
+
+def test_answers_split_into_stripped_columns():
+    valid, _ = validate_questions(pd.DataFrame(ROWS[:2]), SUBJECTS, THEME_SUBJECTS)
+    assert valid[['answer1', 'answer2', 'answer3', 'answer4']].values.tolist() == [['1', '2', '3', '4'], ['а', 'б', 'в', 'г']]
+    assert valid['correct_answer'].tolist() == ['Б', 'Г']
+    assert valid['point'].tolist() == [5, 10]
+
+
+def test_no_valid_rows():
+    valid, errors = validate_questions(pd.DataFrame(ROWS[2:4]), SUBJECTS, THEME_SUBJECTS)
+    assert valid.empty
+    assert errors['row'].tolist() == [1, 2]